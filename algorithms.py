@@ -0,0 +1,63 @@
+# 水印算法注册表
+#
+# 算法以 "模块:类名" 的形式登记，只有在第一次通过 get_algorithm 使用时
+# 才导入对应模块，因此只用LSB的进程不会加载小波相关的依赖。
+# 第三方算法可以调用 register_algorithm 注册，要求类提供 embed/extract 方法。
+import importlib
+import importlib.util
+import sys
+
+_REGISTRY = {}
+
+
+def lazy_import(name):
+    """
+    返回延迟加载的模块：第一次访问其属性时才真正执行导入。
+    模块已导入或找不到时直接使用普通导入(后者会抛出 ImportError)。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        return importlib.import_module(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def register_algorithm(name, target, description=""):
+    """
+    注册算法。target 可以是算法类，也可以是 "模块:类名" 字符串(延迟导入)。
+    同名算法会被覆盖。
+    """
+    _REGISTRY[name.upper()] = {'target': target, 'description': description}
+
+
+def available_algorithms():
+    """返回 {算法名: 说明}"""
+    return {name: entry['description'] for name, entry in _REGISTRY.items()}
+
+
+def get_algorithm_class(name):
+    try:
+        entry = _REGISTRY[name.upper()]
+    except KeyError:
+        raise ValueError(f"未知的水印算法: {name}") from None
+    target = entry['target']
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(':')
+        target = getattr(importlib.import_module(module_name), class_name)
+        entry['target'] = target
+    return target
+
+
+def get_algorithm(name, **kwargs):
+    """创建算法实例，kwargs 传给算法类的构造函数"""
+    return get_algorithm_class(name)(**kwargs)
+
+
+register_algorithm("LSB", "lsb_watermark:LSBWatermark", "最低有效位空域水印")
+register_algorithm("DWT", "dwt_watermark:DWTWatermark", "小波域水印(可配置小波、级数和子带，含盲检测模式)")
@@ -0,0 +1,366 @@
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from algorithms import get_algorithm
+from dwt_config import DWTConfig, check_wavelet, save_image
+from embed_manifest import EmbedManifest, file_digest
+from image_io import as_host_image
+from watermark_cache import watermark_key
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+# 每个工作进程内的全局状态，由 _init_worker 初始化一次
+_worker_watermark = None
+_worker_embedder = None
+
+
+def create_embedder(algorithm, options=None):
+    """根据算法名称创建嵌入器，算法模块在此时才导入；options 为构造参数"""
+    return get_algorithm(algorithm, **(options or {}))
+
+
+def encode_options(options):
+    """把构造参数编码为规范的JSON文本，记入清单用于判断参数是否变化"""
+    encoded = {name: value.to_dict() if isinstance(value, DWTConfig) else value
+               for name, value in (options or {}).items()}
+    return json.dumps(encoded, sort_keys=True)
+
+
+def decode_options(params):
+    options = json.loads(params)
+    if 'config' in options:
+        options['config'] = DWTConfig.from_dict(options['config'])
+    return options or None
+
+
+def load_watermark(watermark_path):
+    watermark = Image.open(watermark_path).convert('L')
+    watermark.load()
+    return watermark
+
+
+def collect_inputs(sources):
+    """将目录、通配符或清单文件(.txt/.lst)展开为图像路径列表"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(source, name))
+        elif source.lower().endswith(('.txt', '.lst')) and os.path.isfile(source):
+            base_dir = os.path.dirname(source)
+            with open(source, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        paths.append(os.path.join(base_dir, line))
+        else:
+            matched = sorted(glob.glob(source))
+            paths.extend(matched if matched else [source])
+
+    # 去重并保持顺序
+    seen = set()
+    unique = []
+    for path in paths:
+        if path not in seen:
+            seen.add(path)
+            unique.append(path)
+    return unique
+
+
+def output_path_for(input_path, output_dir, algorithm):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{stem}_{algorithm.upper()}.png")
+
+
+def _assign_outputs(paths, output_dir, algorithm):
+    """
+    为每个输入分配输出路径。不同目录或不同扩展名的同名输入会得到相同的
+    输出路径，只保留第一个，其余的作为冲突返回，避免互相覆盖。
+    返回 (jobs, conflicts)，conflicts 中每项为 (输入路径, 输出路径, 错误)。
+    """
+    jobs, conflicts = [], []
+    owners = {}
+    for path in paths:
+        output_path = output_path_for(path, output_dir, algorithm)
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key not in owners:
+            owners[key] = path
+            jobs.append((path, output_path))
+        else:
+            conflicts.append((path, output_path,
+                              ValueError(f"输出文件 {output_path} 与输入 {owners[key]} 重名，请重命名其中一个")))
+    return jobs, conflicts
+
+
+def _init_worker(watermark_path, algorithm, options=None):
+    # 每个工作进程只加载一次水印和嵌入器
+    global _worker_watermark, _worker_embedder
+    _worker_watermark = load_watermark(watermark_path)
+    _worker_embedder = create_embedder(algorithm, options)
+
+
+def _embed_one(input_path, output_path):
+    """
+    嵌入一张图像，返回 (像素数, 耗时, 输入哈希, 输入大小, 输入修改时间, 输出哈希)。
+    输入和输出都只读写一次，哈希直接由内存中的数据计算。
+    """
+    start = time.perf_counter()
+    with open(input_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        host_image = as_host_image(img)
+    watermarked = _worker_embedder.embed(host_image, _worker_watermark)
+    # 使用无损PNG保存，避免破坏LSB平面；DWT的嵌入配置写入PNG文本块
+    buffer = io.BytesIO()
+    save_image(watermarked, buffer, format='PNG')
+    with open(output_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return (host_image.size[0] * host_image.size[1], time.perf_counter() - start,
+            file_digest(data=data), stat.st_size, stat.st_mtime_ns, file_digest(data=buffer.getbuffer()))
+
+
+class BatchResult:
+    def __init__(self):
+        self.outputs = {}   # 输入路径 -> 输出路径
+        self.failures = {}  # 输入路径 -> 错误信息
+        self.skipped = {}   # 清单中已是最新的输入路径 -> 输出路径
+        self.pixels = 0
+        self.elapsed = 0.0
+
+    @property
+    def succeeded(self):
+        return len(self.outputs)
+
+    @property
+    def images_per_second(self):
+        return self.succeeded / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def megapixels_per_second(self):
+        return self.pixels / 1e6 / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        skipped = f"跳过 {len(self.skipped)} 张, " if self.skipped else ""
+        return (f"成功 {self.succeeded} 张, 失败 {len(self.failures)} 张, {skipped}"
+                f"耗时 {self.elapsed:.2f}s, "
+                f"{self.images_per_second:.1f} 张/s, "
+                f"{self.megapixels_per_second:.1f} MP/s")
+
+
+def batch_embed(inputs, watermark_path, output_dir, algorithm="LSB", workers=None,
+                on_result=None, options=None, manifest=None, force=False):
+    """
+    批量嵌入水印，不依赖tkinter。
+
+    inputs 可以是目录、通配符、清单文件或图像路径组成的列表；
+    workers 为进程数(None表示CPU核数)，workers=1 时在当前进程内顺序执行。
+    on_result(input_path, output_path, error) 在每张图像完成后回调。
+    options 为传给算法构造函数的参数，例如 {'config': DWTConfig(level=2)}。
+    manifest 为 EmbedManifest 或其文件路径：已用相同水印、算法和参数嵌入且
+    内容未变的输入会被跳过(force=True 时全部重新嵌入)，成功的嵌入记入清单。
+    """
+    if isinstance(manifest, (str, os.PathLike)):
+        with EmbedManifest(manifest) as opened:
+            return batch_embed(inputs, watermark_path, output_dir, algorithm, workers,
+                               on_result, options, opened, force)
+
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    paths = collect_inputs(inputs)
+    create_embedder(algorithm, options)  # 提前校验算法名称和参数
+    os.makedirs(output_dir, exist_ok=True)
+
+    result = BatchResult()
+    start = time.perf_counter()
+
+    jobs, conflicts = _assign_outputs(paths, output_dir, algorithm)
+    if manifest is not None:
+        job_key = (watermark_key(load_watermark(watermark_path)), algorithm, encode_options(options))
+        pending = []
+        for input_path, output_path in jobs:
+            owner = manifest.owner(output_path, exclude=input_path)
+            if owner is not None:
+                # 输出文件属于清单中另一个输入，嵌入前就拒绝，避免覆盖它的输出
+                conflicts.append((input_path, output_path,
+                                  ValueError(f"输出文件 {output_path} 已属于清单中的输入 {owner}")))
+            elif not force and manifest.is_current(input_path, *job_key, output_path):
+                result.skipped[input_path] = output_path
+            else:
+                pending.append((input_path, output_path))
+        jobs = pending
+
+    def record(input_path, output_path, outcome=None, error=None):
+        if error is None:
+            result.outputs[input_path] = output_path
+            result.pixels += outcome[0]
+            if manifest is not None:
+                input_hash, input_size, input_mtime_ns, output_hash = outcome[2:]
+                manifest.record(input_path, input_hash, input_size, input_mtime_ns, *job_key,
+                                output_path, output_hash)
+        else:
+            result.failures[input_path] = f"{type(error).__name__}: {error}"
+        if on_result is not None:
+            on_result(input_path, output_path, result.failures.get(input_path))
+
+    for input_path, output_path, error in conflicts:
+        record(input_path, output_path, error=error)
+
+    if workers == 1:
+        _init_worker(watermark_path, algorithm, options)
+        for input_path, output_path in jobs:
+            try:
+                record(input_path, output_path, _embed_one(input_path, output_path))
+            except Exception as e:
+                record(input_path, output_path, error=e)
+    elif jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(watermark_path, algorithm, options)) as executor:
+            futures = {executor.submit(_embed_one, input_path, output_path): (input_path, output_path)
+                       for input_path, output_path in jobs}
+            for future in as_completed(futures):
+                input_path, output_path = futures[future]
+                try:
+                    record(input_path, output_path, future.result())
+                except Exception as e:
+                    record(input_path, output_path, error=e)
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _verify_entry(entry, watermark, detector, embedders):
+    # 返回 (状态, 相关系数)；先做廉价的文件检查，最后才提取水印
+    if not os.path.exists(entry.output_path):
+        return 'missing', None
+    if file_digest(entry.output_path) != entry.output_hash:
+        return 'modified', None
+    key = (entry.algorithm, entry.params)
+    if key not in embedders:
+        embedders[key] = create_embedder(entry.algorithm, decode_options(entry.params))
+    embedder = embedders[key]
+
+    with Image.open(entry.output_path) as img:
+        marked = as_host_image(img)
+    if entry.algorithm == 'DWT':
+        # 非盲提取需要原始图像，原图变化后无法校验
+        if not os.path.exists(entry.input_path) or file_digest(entry.input_path) != entry.input_hash:
+            return 'source_changed', None
+        with Image.open(entry.input_path) as img:
+            original = as_host_image(img)
+        extracted = embedder.extract(marked, original, watermark.size)
+    else:
+        extracted = embedder.extract(marked, watermark.size)
+
+    detected, correlation = detector.detect(watermark, extracted)
+    return ('ok' if detected else 'not_detected'), float(correlation)
+
+
+def verify_outputs(manifest, watermark_path, sample=20, on_result=None):
+    """
+    抽查清单中用该水印嵌入的至多 sample 个输出，不重新嵌入。
+    依次检查输出是否存在、内容哈希是否与清单一致，再提取水印并用
+    WatermarkDetector 计算与原水印的相关系数。结果写回清单，
+    返回 [(记录, 状态, 相关系数), ...]，状态为 'ok' 表示校验通过。
+    on_result(entry, status, score) 在每条记录校验后回调。
+    """
+    from watermark_detector import WatermarkDetector
+
+    if isinstance(manifest, (str, os.PathLike)):
+        with EmbedManifest(manifest) as opened:
+            return verify_outputs(opened, watermark_path, sample, on_result)
+
+    watermark = load_watermark(watermark_path)
+    detector = WatermarkDetector()
+    embedders = {}
+    results = []
+    for entry in manifest.sample(sample, watermark_key(watermark)):
+        try:
+            status, score = _verify_entry(entry, watermark, detector, embedders)
+        except Exception as e:
+            status, score = f"error: {type(e).__name__}: {e}", None
+        manifest.mark_verified(entry.output_path, status, score)
+        results.append((entry, status, score))
+        if on_result is not None:
+            on_result(entry, status, score)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量嵌入数字水印")
+    parser.add_argument("inputs", nargs="*", help="载体图像目录、通配符或清单文件")
+    parser.add_argument("-w", "--watermark", required=True, help="水印图像路径")
+    parser.add_argument("-o", "--output-dir", help="输出目录")
+    parser.add_argument("-a", "--algorithm", default="LSB", choices=["LSB", "DWT"],
+                        type=str.upper, help="水印算法")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="工作进程数，默认为CPU核数")
+    parser.add_argument("--wavelet", default="haar", help="DWT算法使用的小波")
+    parser.add_argument("--level", type=int, default=3, help="DWT算法的分解级数")
+    parser.add_argument("--alpha", type=float, default=0.01, help="DWT算法的嵌入强度")
+    parser.add_argument("--subbands", nargs="+", default=["LL:1", "LH:0.5", "HL:0.5"],
+                        metavar="子带:相对强度", help="DWT算法的嵌入子带，如 LL:1 LH:0.5")
+    parser.add_argument("--manifest", help="嵌入清单文件(SQLite)，指定后只处理新增或内容变化的图像")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新嵌入")
+    parser.add_argument("--verify", type=int, metavar="N",
+                        help="不做嵌入，从清单中抽查N个输出并检测水印")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只输出汇总信息")
+    args = parser.parse_args(argv)
+
+    if args.verify is not None:
+        if not args.manifest:
+            parser.error("--verify 需要同时指定 --manifest")
+        return _verify_main(args)
+    if not args.inputs or not args.output_dir:
+        parser.error("嵌入时需要指定载体图像和输出目录(-o)")
+
+    options = None
+    if args.algorithm == "DWT":
+        try:
+            strengths = {}
+            for item in args.subbands:
+                name, _, value = item.partition(':')
+                strengths[name.upper()] = float(value or 1)
+            check_wavelet(args.wavelet)
+            options = {'config': DWTConfig(args.wavelet, args.level, args.alpha, strengths)}
+        except ValueError as e:
+            parser.error(str(e))
+
+    def report(input_path, output_path, error):
+        if error is not None:
+            print(f"失败: {input_path}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"完成: {input_path} -> {output_path}")
+
+    result = batch_embed(args.inputs, args.watermark, args.output_dir,
+                         algorithm=args.algorithm, workers=args.workers,
+                         on_result=report, options=options,
+                         manifest=args.manifest, force=args.force)
+    print(result.summary())
+    return 1 if result.failures else 0
+
+
+def _verify_main(args):
+    def report(entry, status, score):
+        if status != 'ok':
+            print(f"未通过: {entry.output_path}: {status}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"通过: {entry.output_path} (相关系数 {score:.3f})")
+
+    results = verify_outputs(args.manifest, args.watermark, args.verify, on_result=report)
+    failed = sum(1 for _, status, _ in results if status != 'ok')
+    print(f"抽查 {len(results)} 个输出, 通过 {len(results) - failed} 个, 未通过 {failed} 个")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Empty
+
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = [256, 512, 1024, 2048, 4096, 8192]
+DEFAULT_WATERMARK_SIZES = [(64, 32), (100, 30), (256, 128)]
+
+# 操作名 -> 需要预先准备的输入图像
+OPERATIONS = {
+    'generate_text': (),
+    'generate_text_cached': (),
+    'generate_text_batch': (),
+    'generate_image': (),
+    'lsb_embed': ('host',),
+    'lsb_extract': ('lsb',),
+    'lsb_embed_batch': ('host',),
+    'lsb_extract_batch': ('lsb',),
+    'dwt_embed': ('host',),
+    'dwt_extract': ('host', 'dwt'),
+    'dwt_embed_tiled': ('host',),
+    'dwt_extract_tiled': ('host', 'dwt'),
+    'dwt_embed_blind': ('host',),
+    'dwt_extract_blind': ('blind',),
+    'dwt_detect_blind': ('blind',),
+    'detect': (),
+    'detect_match': (),
+}
+
+# 与载体尺寸无关的操作只在第一个尺寸上运行
+SIZE_INDEPENDENT = {'generate_text', 'generate_text_cached', 'generate_text_batch', 'generate_image', 'detect', 'detect_match'}
+
+BATCH_COUNT = 16
+REGISTRY_SIZE = 500
+RESULT_POLL_INTERVAL = 1.0
+
+
+def synthetic_host(size, seed=0):
+    """生成可复现的合成载体：低频起伏加细节噪声，比纯噪声更接近自然图像"""
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(40, 216, (max(size // 64, 2),) * 2, dtype=np.uint8))
+    base = np.asarray(coarse.resize((size, size), Image.Resampling.BILINEAR), dtype=np.int16)
+    noise = rng.integers(-20, 21, (size, size), dtype=np.int16)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def synthetic_watermark(size, seed=1):
+    rng = np.random.default_rng(seed)
+    width, height = size
+    blocks = rng.integers(0, 2, (max(height // 8, 1), max(width // 8, 1)), dtype=np.uint8) * 255
+    return Image.fromarray(blocks).resize((width, height), Image.Resampling.NEAREST)
+
+
+def _fixture_path(fixture_dir, name):
+    return os.path.join(fixture_dir, f"{name}.npy")
+
+
+def prepare_fixtures(fixture_dir, size, watermark_size, needed):
+    """准备各操作需要的输入(载体及已嵌入水印的图像)，保存为 .npy 供子进程加载"""
+    from lsb_watermark import LSBWatermark
+    from dwt_watermark import DWTWatermark
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    host = synthetic_host(size)
+    watermark = synthetic_watermark(watermark_size)
+    makers = {
+        'host': lambda: host,
+        'lsb': lambda: LSBWatermark().embed(host, watermark),
+        'dwt': lambda: DWTWatermark().embed_tiled(host, watermark),
+        'blind': lambda: DWTWatermark().embed_blind(host, watermark),
+    }
+    for name in needed:
+        path = _fixture_path(fixture_dir, name)
+        if not os.path.exists(path):
+            np.save(path, np.asarray(makers[name]()))
+
+
+def _peak_rss_mb():
+    # Linux上 ru_maxrss 在 fork/exec 后保留父进程的峰值，优先读取本进程的 VmHWM
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _reset_peak_rss():
+    # 把峰值重置为当前常驻内存，使峰值不包含准备输入数据的开销(Linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _current_rss_mb():
+    # 当前常驻内存；没有 /proc 的平台退化为峰值
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+
+def _build_operation(op, size, watermark_size, fixture_dir):
+    """在子进程中构造待测函数，返回 (函数, 每次调用处理的像素数)"""
+    def load(name):
+        return Image.fromarray(np.load(_fixture_path(fixture_dir, name)))
+
+    watermark = synthetic_watermark(watermark_size)
+    pixels = size * size
+
+    if op in ('generate_text', 'generate_text_cached', 'generate_text_batch', 'generate_image'):
+        from watermark_cache import WatermarkPlaneCache
+        from watermark_generator import WatermarkGenerator
+        generator = WatermarkGenerator()
+        if op == 'generate_text':
+            # 每次使用新的缓存，测量的是渲染本身，可与加入文本缓存之前的结果比较
+            return lambda: WatermarkGenerator(WatermarkPlaneCache()).generate_text_watermark(
+                "benchmark", size=watermark_size), watermark_size[0] * watermark_size[1]
+        if op == 'generate_text_cached':
+            # 第一次之后都命中文本缓存
+            return lambda: generator.generate_text_watermark("benchmark", size=watermark_size), \
+                watermark_size[0] * watermark_size[1]
+        if op == 'generate_text_batch':
+            # 每次渲染一批互不相同且未缓存的文本
+            texts = [f"customer-{i:04d}" for i in range(BATCH_COUNT)]
+            return lambda: WatermarkGenerator(WatermarkPlaneCache()).generate_text_watermarks(
+                texts, size=watermark_size), BATCH_COUNT * watermark_size[0] * watermark_size[1]
+        path = os.path.join(fixture_dir, 'watermark.png')
+        watermark.save(path)
+        return lambda: generator.generate_image_watermark(path, size=watermark_size), \
+            watermark_size[0] * watermark_size[1]
+
+    if op.startswith('lsb'):
+        from lsb_watermark import LSBWatermark
+        lsb = LSBWatermark()
+        if op == 'lsb_embed':
+            host = load('host')
+            return lambda: lsb.embed(host, watermark), pixels
+        if op == 'lsb_extract':
+            marked = load('lsb')
+            return lambda: lsb.extract(marked, watermark_size), pixels
+        if op == 'lsb_embed_batch':
+            hosts = np.repeat(np.load(_fixture_path(fixture_dir, 'host'))[None], BATCH_COUNT, axis=0)
+            out = np.empty_like(hosts)
+            return lambda: lsb.embed_batch(hosts, watermark, out=out), pixels * BATCH_COUNT
+        if op == 'lsb_extract_batch':
+            marked = np.repeat(np.load(_fixture_path(fixture_dir, 'lsb'))[None], BATCH_COUNT, axis=0)
+            return lambda: lsb.extract_batch(marked, watermark_size), pixels * BATCH_COUNT
+
+    if op.startswith('dwt'):
+        from dwt_watermark import DWTWatermark
+        dwt = DWTWatermark()
+        if op == 'dwt_embed':
+            host = load('host')
+            return lambda: dwt.embed(host, watermark), pixels
+        if op == 'dwt_extract':
+            host, marked = load('host'), load('dwt')
+            return lambda: dwt.extract(marked, host, watermark_size), pixels
+        if op == 'dwt_embed_tiled':
+            host = load('host')
+            return lambda: dwt.embed_tiled(host, watermark), pixels
+        if op == 'dwt_extract_tiled':
+            host, marked = load('host'), load('dwt')
+            return lambda: dwt.extract_tiled(marked, host, watermark_size), pixels
+        if op == 'dwt_embed_blind':
+            host = load('host')
+            return lambda: dwt.embed_blind(host, watermark), pixels
+        if op == 'dwt_extract_blind':
+            marked = load('blind')
+            return lambda: dwt.extract_blind(marked, watermark_size), pixels
+        if op == 'dwt_detect_blind':
+            marked = load('blind')
+            return lambda: dwt.detect_blind(marked, watermark), pixels
+
+    if op in ('detect', 'detect_match'):
+        from watermark_detector import WatermarkDetector
+        detector = WatermarkDetector()
+        extracted = synthetic_watermark(watermark_size, seed=2)
+        if op == 'detect':
+            return lambda: detector.detect(watermark, extracted), watermark_size[0] * watermark_size[1]
+        candidates = detector.prepare_candidates(
+            [synthetic_watermark(watermark_size, seed=i) for i in range(REGISTRY_SIZE)])
+        return lambda: detector.match(extracted, candidates), \
+            watermark_size[0] * watermark_size[1] * REGISTRY_SIZE
+
+    raise ValueError(f"未知的操作: {op}")
+
+
+def _run_case(op, size, watermark_size, fixture_dir, repeat, queue, instrument=None):
+    try:
+        func, pixels = _build_operation(op, size, watermark_size, fixture_dir)
+        _reset_peak_rss()
+        rss_before = _current_rss_mb()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        rss_after = _peak_rss_mb()
+        best = min(times)
+        record = {
+            'cold_seconds': times[0],
+            'best_seconds': best,
+            'median_seconds': statistics.median(times),
+            'megapixels_per_second': pixels / 1e6 / best if best > 0 else 0.0,
+            'peak_rss_mb': rss_after,
+            'rss_delta_mb': rss_after - rss_before,
+        }
+        # 阶段统计和剖析在计时之后单独运行，不影响上面的计时结果
+        if instrument == 'stages':
+            import instrumentation
+            instrumentation.enable(memory=True)
+            for _ in range(repeat):
+                func()
+            record['stages'] = instrumentation.snapshot()
+        elif instrument == 'profile':
+            import instrumentation
+            record['profile'] = instrumentation.capture(func).report()
+        queue.put(record)
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def run_case(op, size, watermark_size, fixture_dir, repeat=3, instrument=None):
+    """
+    在全新的子进程中运行一个用例，使峰值内存只反映该操作本身。
+    instrument 为 'stages' 时附带各阶段的耗时和内存分配统计，
+    为 'profile' 时附带单次调用的 cProfile/tracemalloc 报告。
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case,
+                          args=(op, size, watermark_size, fixture_dir, repeat, queue, instrument))
+    process.start()
+    # 子进程可能在放入结果前就退出(例如8192²时被OOM终止或段错误)，不能无限等待
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=RESULT_POLL_INTERVAL)
+        except Empty:
+            if process.is_alive():
+                continue
+            try:
+                # 退出前放入的结果可能还在管道中
+                result = queue.get(timeout=RESULT_POLL_INTERVAL)
+            except Empty:
+                result = {'error': f"子进程异常退出，退出码 {process.exitcode}"}
+    process.join()
+    return result
+
+
+# 导入耗时测量：每项在全新的解释器中执行，记录耗时和实际加载的重量级依赖
+IMPORT_TARGETS = {
+    'lsb_path': "from algorithms import get_algorithm; get_algorithm('LSB')",
+    'dwt_path': "from algorithms import get_algorithm; get_algorithm('DWT')",
+    'lsb_watermark': "import lsb_watermark",
+    'dwt_watermark': "import dwt_watermark",
+    'watermark_detector': "import watermark_detector",
+    'watermark_generator': "import watermark_generator",
+    'batch_embed': "import batch_embed",
+}
+HEAVY_MODULES = ('pywt', 'scipy', 'tkinter')
+
+_IMPORT_PROBE = """
+import sys, time, json, importlib.util
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+loaded = [name for name in {heavy!r} if name in sys.modules
+          and not isinstance(sys.modules[name], importlib.util._LazyModule)]
+print(json.dumps({{'seconds': elapsed, 'loaded': loaded}}))
+"""
+
+
+def measure_import_times(targets=None, repeat=5):
+    """返回 {名称: {'seconds': 最短耗时, 'loaded': [已加载的重量级依赖]}}"""
+    targets = targets or IMPORT_TARGETS
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, statement in targets.items():
+        probe = _IMPORT_PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True,
+                                    cwd=cwd, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[name] = {'seconds': min(run['seconds'] for run in runs), 'loaded': runs[0]['loaded']}
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, watermark_sizes=DEFAULT_WATERMARK_SIZES, operations=None,
+                   repeat=3, on_result=None, instrument=None):
+    """运行基准测试，返回可直接序列化为JSON的结果"""
+    operations = list(operations or OPERATIONS)
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='wm_bench_')
+    try:
+        for size in sizes:
+            for watermark_size in watermark_sizes:
+                fixture_dir = os.path.join(work_dir, f"{size}_{watermark_size[0]}x{watermark_size[1]}")
+                needed = sorted({name for op in operations for name in OPERATIONS[op]})
+                prepare_fixtures(fixture_dir, size, watermark_size, needed)
+                for op in operations:
+                    if op in SIZE_INDEPENDENT and size != sizes[0]:
+                        continue
+                    record = {'operation': op, 'host_size': size,
+                              'watermark_size': list(watermark_size), 'repeat': repeat}
+                    record.update(run_case(op, size, watermark_size, fixture_dir, repeat, instrument))
+                    results.append(record)
+                    if on_result is not None:
+                        on_result(record)
+                shutil.rmtree(fixture_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'environment': _environment(), 'results': results}
+
+
+def _case_key(record):
+    return record['operation'], record['host_size'], tuple(record['watermark_size'])
+
+
+def compare(baseline, current):
+    """比较两次运行的结果，返回 [(用例, 基线耗时, 当前耗时, 加速比), ...]"""
+    base = {_case_key(r): r for r in baseline['results'] if 'best_seconds' in r}
+    rows = []
+    for record in current['results']:
+        key = _case_key(record)
+        if key in base and 'best_seconds' in record:
+            before, after = base[key]['best_seconds'], record['best_seconds']
+            rows.append((key, before, after, before / after if after > 0 else float('inf')))
+    return rows
+
+
+def _format(record):
+    case = f"{record['operation']:<20} {record['host_size']:>5}² wm={record['watermark_size'][0]}x{record['watermark_size'][1]}"
+    if 'error' in record:
+        return f"{case}  错误: {record['error']}"
+    return (f"{case}  {record['best_seconds'] * 1000:9.2f} ms  "
+            f"{record['megapixels_per_second']:9.1f} MP/s  "
+            f"峰值 {record['peak_rss_mb']:8.1f} MB (+{record['rss_delta_mb']:.1f})")
+
+
+def _parse_watermark_size(text):
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数字水印基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="载体边长")
+    parser.add_argument("--watermark-sizes", type=_parse_watermark_size, nargs="+",
+                        default=DEFAULT_WATERMARK_SIZES, help="水印尺寸，如 100x30")
+    parser.add_argument("--ops", nargs="+", choices=list(OPERATIONS), default=None, help="只运行指定的操作")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数")
+    parser.add_argument("--quick", action="store_true", help="只运行小尺寸，用于快速检查")
+    parser.add_argument("-o", "--output", default=None, help="结果JSON文件路径")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果JSON比较")
+    parser.add_argument("--imports", action="store_true", help="只测量各模块的导入耗时")
+    parser.add_argument("--stages", action="store_const", const='stages', dest="instrument",
+                        help="额外输出各阶段的耗时和内存分配")
+    parser.add_argument("--profile", action="store_const", const='profile', dest="instrument",
+                        help="额外输出单次调用的 cProfile/tracemalloc 报告")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        imports = measure_import_times()
+        for name, item in imports.items():
+            loaded = ', '.join(item['loaded']) or '-'
+            print(f"{name:<20} {item['seconds'] * 1000:8.1f} ms  加载: {loaded}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'environment': _environment(), 'imports': imports}, f, ensure_ascii=False, indent=2)
+        return 0
+
+    sizes = [256, 1024] if args.quick else args.sizes
+    watermark_sizes = [(100, 30)] if args.quick else args.watermark_sizes
+
+    def show(record):
+        print(_format(record), flush=True)
+        if 'stages' in record:
+            from instrumentation import format_stages
+            print(format_stages(record['stages']) + "\n", flush=True)
+        if 'profile' in record:
+            print(record['profile'], flush=True)
+
+    report = run_benchmarks(sizes, watermark_sizes, args.ops, args.repeat,
+                            on_result=show, instrument=args.instrument)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n与 {baseline['environment'].get('commit', '')[:10]} 的比较:")
+        for (op, size, wm_size), before, after, speedup in compare(baseline, report):
+            print(f"{op:<20} {size:>5}² wm={wm_size[0]}x{wm_size[1]}  "
+                  f"{before * 1000:9.2f} -> {after * 1000:9.2f} ms  x{speedup:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import functools
+import json
+import math
+import os
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+from algorithms import lazy_import
+
+# DWT水印的配置：小波、分解级数、嵌入子带及各子带强度
+#
+# 嵌入结果的PIL图像在 info 中携带配置，save_image 保存为PNG时写入
+# 文本块，其他格式写入同名的 .dwt.json 附属文件。提取时读取该配置并与
+# 当前配置比较，不一致时报错，而不是静默地提取出噪声。
+
+pywt = lazy_import('pywt')
+
+SUBBANDS = ('LL', 'LH', 'HL', 'HH')
+# 细节子带在 pywt.wavedec2 结果元组中的位置
+DETAIL_INDEX = {'LH': 0, 'HL': 1, 'HH': 2}
+
+CONFIG_KEY = 'dwt-watermark'
+CONFIG_VERSION = 1
+SIDECAR_SUFFIX = '.dwt.json'
+
+
+class DWTConfig:
+    """
+    DWT水印配置，创建后不可修改(用 replace 生成新配置)。
+
+    wavelet    pywt 离散小波名称，如 'haar'、'db2'(为避免提前加载pywt，名称在
+               第一次变换时校验，也可以直接调用 check_wavelet)
+    level      分解级数，水印嵌入最深一级的子带
+    alpha      基础嵌入强度
+    strengths  {子带: 相对强度}，子带的实际强度为 alpha * 相对强度
+    """
+
+    def __init__(self, wavelet='haar', level=3, alpha=0.01, strengths=None):
+        if strengths is None:
+            strengths = {'LL': 1.0, 'LH': 0.5, 'HL': 0.5}
+        if not isinstance(wavelet, str) or not wavelet:
+            raise ValueError(f"小波名称必须是非空字符串: {wavelet!r}")
+        if isinstance(level, bool) or not isinstance(level, int) or level < 1:
+            raise ValueError(f"分解级数必须是正整数: {level!r}")
+        alpha = float(alpha)
+        if not math.isfinite(alpha) or alpha <= 0:
+            raise ValueError(f"嵌入强度必须是正数: {alpha}")
+        if not strengths:
+            raise ValueError("至少需要选择一个子带")
+        unknown = set(strengths) - set(SUBBANDS)
+        if unknown:
+            raise ValueError(f"未知的子带: {sorted(unknown)}，可选 {list(SUBBANDS)}")
+        checked = {}
+        for name in SUBBANDS:
+            if name in strengths:
+                value = float(strengths[name])
+                if not math.isfinite(value) or value <= 0:
+                    raise ValueError(f"子带 {name} 的强度必须是正数: {value}")
+                checked[name] = value
+
+        self._wavelet = wavelet
+        self._level = level
+        self._alpha = alpha
+        self._strengths = checked
+
+    @property
+    def wavelet(self):
+        return self._wavelet
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def alpha(self):
+        return self._alpha
+
+    @property
+    def strengths(self):
+        return dict(self._strengths)
+
+    @property
+    def subbands(self):
+        """按 LL、LH、HL、HH 顺序排列的嵌入子带"""
+        return tuple(self._strengths)
+
+    def strength(self, subband):
+        return self._alpha * self._strengths[subband]
+
+    @property
+    def tag(self):
+        # 用于子带缓存等场合区分不同的分解方式
+        return f"{self._wavelet}-{self._level}-{'.'.join(self.subbands)}"
+
+    def replace(self, **changes):
+        params = {'wavelet': self._wavelet, 'level': self._level,
+                  'alpha': self._alpha, 'strengths': self._strengths}
+        params.update(changes)
+        return DWTConfig(**params)
+
+    def plan(self, shape):
+        """返回该配置在给定图像尺寸下的变换元数据(有缓存)"""
+        return transform_plan(tuple(shape[:2]), self._wavelet, self._level)
+
+    def _key(self):
+        return (self._wavelet, self._level, self._alpha, tuple(self._strengths.items()))
+
+    def __eq__(self, other):
+        return isinstance(other, DWTConfig) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return (f"DWTConfig(wavelet={self._wavelet!r}, level={self._level}, "
+                f"alpha={self._alpha:g}, strengths={self._strengths})")
+
+    def differences(self, other, fields=('wavelet', 'level', 'alpha', 'strengths')):
+        """返回与另一配置在指定字段上的差异描述列表"""
+        return [f"{field}: {getattr(other, field)!r} != {getattr(self, field)!r}"
+                for field in fields if getattr(self, field) != getattr(other, field)]
+
+    def to_dict(self):
+        return {'version': CONFIG_VERSION, 'wavelet': self._wavelet, 'level': self._level,
+                'alpha': self._alpha, 'strengths': dict(self._strengths)}
+
+    @classmethod
+    def from_dict(cls, data):
+        version = data.get('version', CONFIG_VERSION)
+        if version != CONFIG_VERSION:
+            raise ValueError(f"不支持的DWT配置版本: {version}")
+        return cls(wavelet=data['wavelet'], level=data['level'], alpha=data['alpha'],
+                   strengths=data['strengths'])
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+
+def check_wavelet(name):
+    """返回 pywt 小波对象，名称不是离散小波时抛出 ValueError"""
+    try:
+        return pywt.Wavelet(name)
+    except ValueError:
+        raise ValueError(f"未知的离散小波: {name}") from None
+
+
+class TransformPlan:
+    """
+    某个图像尺寸下的变换元数据：小波对象、各级系数尺寸。
+    按 (尺寸, 小波, 级数) 缓存，重复处理同尺寸图像时不再重新计算和校验。
+    """
+
+    def __init__(self, shape, wavelet, level):
+        self.wavelet = check_wavelet(wavelet)
+        self.shape = tuple(shape)
+        self.level = level
+
+        max_level = pywt.dwt_max_level(min(self.shape), self.wavelet.dec_len)
+        if level > max_level:
+            raise ValueError(f"{self.shape[1]}x{self.shape[0]} 的图像使用 {wavelet} 小波"
+                             f"最多只能分解 {max_level} 级，当前配置为 {level} 级")
+
+        # 每一级近似系数的尺寸，最后一项即嵌入子带的尺寸
+        rows, cols = self.shape
+        self.coeff_shapes = []
+        for _ in range(level):
+            rows = pywt.dwt_coeff_len(rows, self.wavelet, 'symmetric')
+            cols = pywt.dwt_coeff_len(cols, self.wavelet, 'symmetric')
+            self.coeff_shapes.append((rows, cols))
+        self.subband_shape = self.coeff_shapes[-1]
+
+    def decompose(self, array, details=True):
+        return wavedec2(array, self.wavelet, self.level, details)
+
+    def reconstruct(self, coeffs):
+        return waverec2(coeffs, self.wavelet)
+
+
+@functools.lru_cache(maxsize=64)
+def transform_plan(shape, wavelet, level):
+    return TransformPlan(shape, wavelet, level)
+
+
+DEFAULT_CONFIG = DWTConfig()
+
+
+# ----------------------------------------------------------------------
+# 小波变换
+#
+# 结果与 pywt.wavedec2/waverec2(mode='symmetric') 逐位一致，全程保持float32。
+# haar小波直接用numpy计算：每个输出都是两个输入各乘以 1/sqrt(2) 后相加
+# 或相减，与pywt的float32运算完全相同。二维变换按行分块同时完成两个
+# 方向，临时数组只有一块的大小，也避免了pywt沿第0轴变换大数组时的缓存
+# 失效，整图变换快数倍。uint8输入直接参与运算(转换为float32是精确的)，
+# 不需要先复制出整幅float32图像。其他小波仍调用pywt。
+# ----------------------------------------------------------------------
+_HAAR_SCALE = np.float32(np.sqrt(0.5))
+_BLOCK_ROWS = 32
+
+
+def _haar_pair(even, odd, approx, detail):
+    # approx = even*s + odd*s, detail = even*s - odd*s
+    scaled_odd = np.multiply(odd, _HAAR_SCALE, dtype=np.float32)
+    np.multiply(even, _HAAR_SCALE, out=approx, dtype=np.float32)
+    np.subtract(approx, scaled_odd, out=detail)
+    np.add(approx, scaled_odd, out=approx)
+
+
+def _haar_split_columns(block, approx, detail):
+    # 沿第1轴分解一块行，列数为奇数时最后一列与自身配对(symmetric扩展)
+    half = block.shape[1] // 2
+    _haar_pair(block[:, 0:2 * half:2], block[:, 1:2 * half:2], approx[:, :half], detail[:, :half])
+    if block.shape[1] % 2:
+        _haar_pair(block[:, -1:], block[:, -1:], approx[:, half:], detail[:, half:])
+
+
+def _haar_dwt2(x):
+    # 一级二维haar分解：先沿第0轴再沿第1轴，与 pywt.dwt2 相同
+    rows, cols = x.shape
+    shape = ((rows + 1) // 2, (cols + 1) // 2)
+    cA, cH, cV, cD = (np.empty(shape, dtype=np.float32) for _ in range(4))
+    low = np.empty((_BLOCK_ROWS, cols), dtype=np.float32)
+    high = np.empty((_BLOCK_ROWS, cols), dtype=np.float32)
+    for r0 in range(0, shape[0], _BLOCK_ROWS):
+        r1 = min(shape[0], r0 + _BLOCK_ROWS)
+        even = x[2 * r0:2 * r1:2]
+        odd = x[2 * r0 + 1:2 * r1:2]
+        if odd.shape[0] < even.shape[0]:
+            # 行数为奇数时最后一行与自身配对
+            odd = np.concatenate([odd, even[-1:]])
+        n = r1 - r0
+        _haar_pair(even, odd, low[:n], high[:n])
+        _haar_split_columns(low[:n], cA[r0:r1], cV[r0:r1])
+        _haar_split_columns(high[:n], cH[r0:r1], cD[r0:r1])
+    return cA, (cH, cV, cD)
+
+
+def _haar_merge(approx, detail, out_even, out_odd):
+    scaled_approx = np.multiply(approx, _HAAR_SCALE)
+    scaled_detail = np.multiply(detail, _HAAR_SCALE)
+    np.add(scaled_approx, scaled_detail, out=out_even)
+    np.subtract(scaled_approx, scaled_detail, out=out_odd)
+
+
+def _haar_idwt2(cA, cH, cV, cD):
+    # 一级二维haar重构：先沿第1轴再沿第0轴，与 pywt.idwt2 相同
+    rows, cols = cH.shape
+    out = np.empty((2 * rows, 2 * cols), dtype=np.float32)
+    low = np.empty((_BLOCK_ROWS, 2 * cols), dtype=np.float32)
+    high = np.empty((_BLOCK_ROWS, 2 * cols), dtype=np.float32)
+    for r0 in range(0, rows, _BLOCK_ROWS):
+        r1 = min(rows, r0 + _BLOCK_ROWS)
+        n = r1 - r0
+        _haar_merge(cA[r0:r1], cV[r0:r1], low[:n, 0::2], low[:n, 1::2])
+        _haar_merge(cH[r0:r1], cD[r0:r1], high[:n, 0::2], high[:n, 1::2])
+        _haar_merge(low[:n], high[:n], out[2 * r0:2 * r1:2], out[2 * r0 + 1:2 * r1:2])
+    return out
+
+
+def _is_haar(wavelet):
+    return (wavelet.name if hasattr(wavelet, 'name') else wavelet) == 'haar'
+
+
+def wavedec2(array, wavelet, level, details=True):
+    """
+    多级二维小波分解，返回与 pywt.wavedec2 相同结构的 [cA, (cH, cV, cD), ...]。
+    details=False 时只保留最深一级的细节子带 [cA, (cH, cV, cD)]，
+    中间各级的细节在计算后立即释放，用于只需要最深一级子带的提取和检测。
+    """
+    array = np.asarray(array)
+    if array.dtype not in (np.uint8, np.float32):
+        array = array.astype(np.float32)
+    if not _is_haar(wavelet):
+        coeffs = pywt.wavedec2(array.astype(np.float32, copy=False), wavelet, level=level)
+        return coeffs if details else coeffs[:2]
+
+    collected = []
+    approx = array
+    for _ in range(level):
+        approx, detail = _haar_dwt2(approx)
+        if details:
+            collected.append(detail)
+        else:
+            collected = [detail]
+    return [approx] + collected[::-1]
+
+
+def waverec2(coeffs, wavelet):
+    """多级二维小波重构，与 pywt.waverec2 相同"""
+    if not _is_haar(wavelet):
+        return pywt.waverec2(coeffs, wavelet)
+    approx = coeffs[0]
+    for cH, cV, cD in coeffs[1:]:
+        # 上一级为奇数尺寸时，近似子带比细节子带多一行/一列
+        approx = _haar_idwt2(approx[:cH.shape[0], :cH.shape[1]], cH, cV, cD)
+    return approx
+
+
+# ----------------------------------------------------------------------
+# 配置随图像保存和读取
+# ----------------------------------------------------------------------
+def attach_config(image, config):
+    """把配置记录到PIL图像的 info 中，返回该图像"""
+    image.info[CONFIG_KEY] = config.to_json()
+    return image
+
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+
+def read_config(source):
+    """
+    读取图像携带的DWT配置，source 可以是PIL图像或文件路径。
+    依次查找图像 info(PNG文本块)和附属文件，都没有时返回 None。
+    """
+    if isinstance(source, Image.Image):
+        text = source.info.get(CONFIG_KEY)
+        path = getattr(source, 'filename', None) or None
+    else:
+        path = os.fspath(source)
+        with Image.open(path) as image:
+            text = image.info.get(CONFIG_KEY)
+    if text is None and path and os.path.exists(sidecar_path(path)):
+        with open(sidecar_path(path), encoding='utf-8') as f:
+            text = f.read()
+    return DWTConfig.from_json(text) if text is not None else None
+
+
+def save_image(image, fp, format=None, **params):
+    """
+    保存图像，并保留其携带的DWT配置：PNG写入文本块，
+    其他格式(仅限文件路径)写入 .dwt.json 附属文件。
+    """
+    text = image.info.get(CONFIG_KEY)
+    if text is None:
+        image.save(fp, format=format, **params)
+        return
+    is_path = isinstance(fp, (str, os.PathLike))
+    if format is None and is_path:
+        format = Image.registered_extensions().get(os.path.splitext(os.fspath(fp))[1].lower())
+    if format is not None and format.upper() == 'PNG':
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text(CONFIG_KEY, text)
+        image.save(fp, format=format, pnginfo=pnginfo, **params)
+        return
+    image.save(fp, format=format, **params)
+    if is_path:
+        with open(sidecar_path(os.fspath(fp)), 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -1,74 +1,234 @@
+from concurrent.futures import CancelledError
+
 import numpy as np
-import pywt
 from PIL import Image
 from PIL import ImageFilter
 
+from dwt_config import DEFAULT_CONFIG, DETAIL_INDEX, attach_config, read_config, wavedec2, waverec2
+from instrumentation import stage
+from mmap_io import release_pages
+from watermark_cache import default_plane_cache
+
+# ITU-R BT.601 亮度系数，与PIL的 convert('L') 一致
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
 class DWTWatermark:
-    def __init__(self):
-        self.alpha = 0.01  # 进一步降低水印强度因子
+    def __init__(self, subband_cache=None, plane_cache=None, config=None):
+        # 小波、分解级数、嵌入子带和强度，见 dwt_config.DWTConfig
+        self.config = DEFAULT_CONFIG if config is None else config
+        # 可选的 SubbandCache，用于复用原始图像的小波分解结果
+        self.subband_cache = subband_cache
+        # 预处理后水印数组的缓存，默认使用进程内共享的缓存
+        self.plane_cache = plane_cache if plane_cache is not None else default_plane_cache
+        # 盲检测模式参数：伪随机序列的密钥、嵌入强度(小波系数单位)和检测阈值(z值)
+        self.key = 0
+        self.blind_strength = 8.0
+        self.blind_threshold = 4.0
+    
+    @property
+    def alpha(self):
+        return self.config.alpha
+    
+    @alpha.setter
+    def alpha(self, value):
+        self.config = self.config.replace(alpha=value)
+    
+    @classmethod
+    def for_image(cls, image, **kwargs):
+        """按图像(或文件路径)携带的配置创建实例，没有配置时使用默认配置"""
+        return cls(config=read_config(image), **kwargs)
+    
+    def _check_config(self, image, fields=('wavelet', 'level', 'alpha', 'strengths')):
+        # 图像携带的嵌入配置与当前配置不一致时报错，避免提取出噪声
+        if not isinstance(image, Image.Image):
+            return
+        stored = read_config(image)
+        if stored is None:
+            return
+        differences = self.config.differences(stored, fields)
+        if differences:
+            raise ValueError("图像的水印配置与当前配置不一致(嵌入时 != 当前): " + "; ".join(differences))
         
     def embed(self, host_image, watermark):
-        # 转换为numpy数组
-        host_array = np.array(host_image).astype(np.float32)
+        # 彩色图像只在亮度(Y)通道上嵌入
+        if self._is_color(host_image):
+            return attach_config(self._embed_luma(host_image, lambda luma: self.embed(luma, watermark)),
+                                 self.config)
         
-        # 对主图像进行3级小波变换，增加隐藏深度
-        coeffs2 = pywt.wavedec2(host_array, 'haar', level=3)
+        # uint8像素直接参与小波分解，不复制出整幅float32数组，系数全程保持float32
+        with stage("dwt.embed.load"):
+            host_array = np.asarray(host_image)
+            plan = self.config.plan(host_array.shape)
         
-        # 获取第三级的所有子带
-        LL3 = coeffs2[0]
-        (LH3, HL3, HH3) = coeffs2[1]
-        
-        # 将水印调整为LL3子带的大小
-        watermark = watermark.resize((LL3.shape[1], LL3.shape[0]), Image.Resampling.LANCZOS)
-        watermark_array = np.array(watermark).astype(np.float32)
+        # 对主图像进行多级小波变换，增加隐藏深度
+        with stage("dwt.embed.wavedec2"):
+            coeffs2 = plan.decompose(host_array)
+        del host_array
         
-        # 将水印归一化到[-1,1]范围
-        watermark_array = (watermark_array / 255.0 * 2) - 1
+        # 将水印调整为嵌入子带的大小，并换算为各子带的嵌入系数
+        with stage("dwt.embed.resize"):
+            factors = self._embed_factors(watermark, plan.subband_shape)
         
-        # 在多个子带中分散嵌入水印，使用不同的强度
-        LL3_watermarked = LL3 * (1 + self.alpha * watermark_array)
-        LH3_watermarked = LH3 * (1 + self.alpha * 0.5 * watermark_array)
-        HL3_watermarked = HL3 * (1 + self.alpha * 0.5 * watermark_array)
-        
-        # 更新系数
-        coeffs2[0] = LL3_watermarked
-        coeffs2[1] = (LH3_watermarked, HL3_watermarked, HH3)
+        # 在多个子带中分散嵌入水印，使用不同的强度(原地修改系数)
+        with stage("dwt.embed.apply"):
+            self._apply_factors(coeffs2, factors)
         
         # 逆变换
-        watermarked = pywt.waverec2(coeffs2, 'haar')
+        with stage("dwt.embed.waverec2"):
+            watermarked = plan.reconstruct(coeffs2)
+        del coeffs2
         
         # 确保像素值在有效范围内，使用更平滑的裁剪
-        watermarked = np.clip(watermarked, 0, 255)
+        with stage("dwt.embed.clip"):
+            np.clip(watermarked, 0, 255, out=watermarked)
+            watermarked_image = Image.fromarray(watermarked.astype(np.uint8))
         
         # 平滑处理，减少可能的锯齿
-        watermarked_image = Image.fromarray(watermarked.astype(np.uint8))
-        watermarked_image = watermarked_image.filter(ImageFilter.SMOOTH)
+        with stage("dwt.embed.smooth"):
+            watermarked_image = watermarked_image.filter(ImageFilter.SMOOTH)
         
-        return watermarked_image
+        return attach_config(watermarked_image, self.config)
     
     def extract(self, watermarked_image, original_image, watermark_size):
-        # 转换为numpy数组
-        watermarked_array = np.array(watermarked_image).astype(np.float32)
-        original_array = np.array(original_image).astype(np.float32)
+        self._check_config(watermarked_image)
         
-        # 对两个图像进行3级小波变换
-        w_coeffs2 = pywt.wavedec2(watermarked_array, 'haar', level=3)
-        o_coeffs2 = pywt.wavedec2(original_array, 'haar', level=3)
+        # 转换为numpy数组，彩色图像取亮度通道
+        with stage("dwt.extract.load"):
+            watermarked_array = self._as_array(watermarked_image)
+            original_array = self._as_array(original_image)
+            plan = self.config.plan(watermarked_array.shape)
         
-        # 获取第三级子带
-        w_LL3 = w_coeffs2[0]
-        o_LL3 = o_coeffs2[0]
-        w_LH3, w_HL3, _ = w_coeffs2[1]
-        o_LH3, o_HL3, _ = o_coeffs2[1]
+        # 对两个图像进行小波变换(只保留最深一级子带)，原始图像的子带可以从缓存中获取
+        with stage("dwt.extract.wavedec2"):
+            w_coeffs2 = plan.decompose(watermarked_array, details=False)
+        del watermarked_array
+        with stage("dwt.extract.reference"):
+            o_subbands = self._original_subbands(original_array)
         
         # 从多个子带提取水印并组合
-        extracted_LL = (w_LL3 / (o_LL3 + 1e-8) - 1) / self.alpha
-        extracted_LH = (w_LH3 / (o_LH3 + 1e-8) - 1) / (self.alpha * 0.5)
-        extracted_HL = (w_HL3 / (o_HL3 + 1e-8) - 1) / (self.alpha * 0.5)
+        with stage("dwt.extract.combine"):
+            extracted = self._combine_ratios(self._select_subbands(w_coeffs2), o_subbands)
+        
+        return self._postprocess_extracted(extracted, watermark_size)
+    
+    # ------------------------------------------------------------------
+    # 子带选择：按 config.subbands 的顺序取出/修改嵌入子带
+    # ------------------------------------------------------------------
+    def _select_subbands(self, coeffs2, rows=slice(None), cols=slice(None)):
+        return [coeffs2[0][rows, cols] if name == 'LL' else coeffs2[1][DETAIL_INDEX[name]][rows, cols]
+                for name in self.config.subbands]
+    
+    def _apply_factors(self, coeffs2, factors, rows=slice(None), cols=slice(None)):
+        # 各嵌入子带原地乘以对应的嵌入系数，rows/cols 为分块模式下系数在整图中的位置
+        for band, factor in zip(self._select_subbands(coeffs2), factors):
+            band *= factor[rows, cols]
+    
+    def _combine_ratios(self, w_subbands, o_subbands, out=None):
+        """
+        各子带 (w / (o + 1e-8) - 1) / 强度 的平均值，结果写入 out(可以是更大数组的视图)。
+        逐子带在同一个缓冲区中完成全部运算后累加，除 out 外只需一个子带大小的临时数组，
+        运算顺序与逐项计算完全相同。
+        """
+        if out is None:
+            out = np.empty(w_subbands[0].shape, dtype=np.float32)
+        scratch = None
+        for i, (name, w_band, o_band) in enumerate(zip(self.config.subbands, w_subbands, o_subbands)):
+            if i == 0:
+                target = out
+            else:
+                if scratch is None:
+                    scratch = np.empty_like(out)
+                target = scratch
+            np.add(o_band, 1e-8, out=target)
+            np.divide(w_band, target, out=target)
+            np.subtract(target, 1, out=target)
+            np.divide(target, self.config.strength(name), out=target)
+            if i:
+                np.add(out, scratch, out=out)
+        np.divide(out, len(self.config.subbands), out=out)
+        return out
+    
+    # ------------------------------------------------------------------
+    # 彩色图像支持：只在亮度通道上嵌入/提取
+    #
+    # 对RGB图像，亮度 Y = 0.299R + 0.587G + 0.114B；把嵌入后亮度的变化量
+    # dY 同时加到R、G、B上，Y 恰好改变 dY 而色度(Cb、Cr)保持不变，
+    # 因此无需做完整的 RGB<->YCbCr 转换。YCbCr 模式的PIL图像直接修改Y通道。
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _is_color(image):
+        if isinstance(image, Image.Image):
+            return len(image.getbands()) >= 3
+        return np.ndim(image) == 3
+    
+    @staticmethod
+    def _luma(pixels):
+        # 逐通道累加，避免把整幅 (H, W, C) 数组转换为浮点
+        luma = np.multiply(pixels[..., 0], np.float32(LUMA_WEIGHTS[0]), dtype=np.float32)
+        scratch = np.empty_like(luma)
+        for channel, weight in ((1, LUMA_WEIGHTS[1]), (2, LUMA_WEIGHTS[2])):
+            np.multiply(pixels[..., channel], np.float32(weight), out=scratch)
+            luma += scratch
+        return luma
+    
+    def _as_array(self, image):
+        # 灰度图像保持原数据类型(由小波分解转换为float32)，彩色图像取亮度通道
+        if not self._is_color(image):
+            return np.asarray(image)
+        pixels = np.asarray(image)
+        if isinstance(image, Image.Image) and image.mode == 'YCbCr':
+            return pixels[..., 0].astype(np.float32)
+        return self._luma(pixels)
+    
+    def _embed_luma(self, host_image, embed_gray):
+        pixels = np.asarray(host_image)
+        ycbcr = isinstance(host_image, Image.Image) and host_image.mode == 'YCbCr'
+        luma = pixels[..., 0].astype(np.float32) if ycbcr else self._luma(pixels)
         
-        # 组合提取结果
-        extracted = (extracted_LL + extracted_LH + extracted_HL) / 3
+        # 整图DWT在奇数尺寸时会补齐一行/一列，裁回原尺寸
+        marked = np.asarray(embed_gray(luma), dtype=np.float32)[:luma.shape[0], :luma.shape[1]]
         
+        if ycbcr:
+            out = pixels.copy()
+            out[..., 0] = np.clip(np.rint(marked), 0, 255)
+            return Image.frombytes('YCbCr', host_image.size, out.tobytes())
+        
+        # 亮度变化量加到所有颜色通道(不包括alpha通道)，一次完成
+        marked -= luma
+        delta = np.rint(marked).astype(np.int16)
+        out = pixels.astype(np.int16)
+        out[..., :3] += delta[..., None]
+        np.clip(out, 0, 255, out=out)
+        return Image.fromarray(out.astype(np.uint8))
+    
+    def _embed_factors(self, watermark, shape):
+        # 返回按 (水印, 尺寸, 强度) 缓存的各嵌入子带的系数因子，顺序同 config.subbands
+        config = self.config
+        def build():
+            resized = watermark.resize((shape[1], shape[0]), Image.Resampling.LANCZOS)
+            watermark_array = np.array(resized).astype(np.float32)
+            
+            # 将水印归一化到[-1,1]范围
+            watermark_array = (watermark_array / 255.0 * 2) - 1
+            return np.stack([1 + config.strength(name) * watermark_array for name in config.subbands])
+        param = (config.alpha, tuple(config.strengths.items()))
+        return self.plane_cache.get(watermark, shape, 'DWT', param, build)
+    
+    def _decompose_reference(self, original_array):
+        plan = self.config.plan(original_array.shape)
+        return tuple(self._select_subbands(plan.decompose(original_array, details=False)))
+    
+    def _original_subbands(self, original_array):
+        if self.subband_cache is None:
+            return self._decompose_reference(original_array)
+        return self.subband_cache.get_or_compute(original_array, self._decompose_reference,
+                                                 tag=self.config.tag)
+    
+    def _postprocess_extracted(self, extracted, watermark_size):
+        with stage("dwt.extract.postprocess"):
+            return self._threshold_extracted(extracted, watermark_size)
+    
+    def _threshold_extracted(self, extracted, watermark_size):
         # 调整像素范围到[0,255]
         extracted = ((extracted + 1) / 2) * 255
         extracted = np.clip(extracted, 0, 255)
@@ -88,4 +248,252 @@ class DWTWatermark:
         # 对提取的水印进行后处理
         extracted_image = extracted_image.filter(ImageFilter.SMOOTH)
         
-        return extracted_image 
\ No newline at end of file
+        return extracted_image
+    
+    # ------------------------------------------------------------------
+    # 分块(流式)模式：用于超大图像，峰值内存只与分块大小有关
+    #
+    # haar小波的n级分解在 2**n 对齐的块内是完全独立的，因此只要分块起点
+    # 按 2**n 对齐，各块的子带系数与整图分解结果一致(其他小波的支撑长度
+    # 大于2，块之间会相互影响，因此分块模式只支持haar)；嵌入时每块额外
+    # 读取 TILE_HALO 像素(向上取整到 2**n)的重叠边，以保证 ImageFilter.SMOOTH
+    # (3x3 卷积)在块边界处的结果也与整图一致。
+    #
+    # 误差说明(默认3级)：对宽高均为8的倍数的图像，分块结果与 embed()/extract() 的
+    # 整图结果一致，容差为每像素±1个灰度级(仅来自浮点舍入后的截断)；
+    # 宽高不是8的倍数时，整图 embed() 会返回被补齐到偶数尺寸的图像，
+    # 而分块模式始终返回与载体相同的尺寸，此时除最后一行/一列受平滑
+    # 边界处理影响外，其余像素同样满足±1的容差。
+    # ------------------------------------------------------------------
+    TILE_SIZE = 1024
+    TILE_HALO = 8
+    
+    def _tile_alignment(self):
+        if self.config.wavelet != 'haar':
+            raise ValueError(f"分块模式只支持haar小波，当前配置为 {self.config.wavelet}")
+        return 2 ** self.config.level
+    
+    def _iter_tiles(self, shape, tile_size):
+        align = self._tile_alignment()
+        if tile_size <= 0 or tile_size % align:
+            raise ValueError(f"分块大小必须是{align}的正整数倍: {tile_size}")
+        height, width = shape
+        for y0 in range(0, height, tile_size):
+            for x0 in range(0, width, tile_size):
+                yield y0, x0, min(y0 + tile_size, height), min(x0 + tile_size, width)
+    
+    @staticmethod
+    def _read_region(image, y0, x0, y1, x1):
+        # 支持PIL图像(按区域裁剪)和numpy数组/np.memmap(切片视图)
+        if isinstance(image, Image.Image):
+            return np.asarray(image.crop((x0, y0, x1, y1)), dtype=np.float32)
+        return np.asarray(image[y0:y1, x0:x1], dtype=np.float32)
+    
+    @staticmethod
+    def _image_shape(image):
+        if isinstance(image, Image.Image):
+            return image.size[1], image.size[0]
+        return image.shape[:2]
+    
+    def embed_tiled(self, host_image, watermark, tile_size=TILE_SIZE, out=None, cancel=None):
+        """
+        分块嵌入水印。host_image 可以是PIL灰度图像或二维uint8数组(包括np.memmap)；
+        out 为可选的与载体同尺寸的uint8输出数组(例如 np.lib.format.open_memmap
+        打开的文件)，结果逐块写入其中。未提供 out 时返回PIL图像。
+        cancel 为可选的 threading.Event，每块开始前检查，已设置时抛出 CancelledError。
+        """
+        shape = self._image_shape(host_image)
+        height, width = shape
+        align = self._tile_alignment()
+        plan = self.config.plan(shape)
+        
+        # 水印只需调整到整图嵌入子带的大小(3级时只有载体的1/64)
+        with stage("dwt.embed_tiled.resize"):
+            factors = self._embed_factors(watermark, plan.subband_shape)
+        
+        if out is None:
+            result = np.empty(shape, dtype=np.uint8)
+        else:
+            if out.shape[:2] != tuple(shape) or out.dtype != np.uint8:
+                raise ValueError("输出数组的尺寸和类型必须与载体图像一致(uint8)")
+            result = out
+        
+        halo = -(-self.TILE_HALO // align) * align
+        for y0, x0, y1, x1 in self._iter_tiles(shape, tile_size):
+            if cancel is not None and cancel.is_set():
+                raise CancelledError()
+            # 带重叠边的读取区域，起点保持对齐
+            ry0, rx0 = max(0, y0 - halo), max(0, x0 - halo)
+            ry1, rx1 = min(height, y1 + halo), min(width, x1 + halo)
+            with stage("dwt.embed_tiled.read"):
+                region = self._read_region(host_image, ry0, rx0, ry1, rx1)
+            
+            with stage("dwt.embed_tiled.wavedec2"):
+                coeffs2 = wavedec2(region, plan.wavelet, plan.level)
+            
+            with stage("dwt.embed_tiled.apply"):
+                cy, cx = ry0 // align, rx0 // align
+                rows = slice(cy, cy + coeffs2[0].shape[0])
+                cols = slice(cx, cx + coeffs2[0].shape[1])
+                self._apply_factors(coeffs2, factors, rows, cols)
+            
+            with stage("dwt.embed_tiled.waverec2"):
+                watermarked = waverec2(coeffs2, plan.wavelet)[:ry1 - ry0, :rx1 - rx0]
+            np.clip(watermarked, 0, 255, out=watermarked)
+            
+            with stage("dwt.embed_tiled.smooth"):
+                tile_image = Image.fromarray(watermarked.astype(np.uint8))
+                tile_image = tile_image.filter(ImageFilter.SMOOTH)
+            
+            # 只写回去掉重叠边后的内部区域
+            with stage("dwt.embed_tiled.write"):
+                result[y0:y1, x0:x1] = np.asarray(tile_image)[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+                # 输入/输出为内存映射文件时，把已处理的页交还给系统
+                release_pages(result)
+                release_pages(host_image)
+        
+        if out is None:
+            return attach_config(Image.fromarray(result), self.config)
+        if hasattr(out, 'flush'):
+            out.flush()
+        return out
+    
+    def extract_tiled(self, watermarked_image, original_image, watermark_size, tile_size=TILE_SIZE):
+        """
+        分块提取水印，参数含义与 extract() 相同，图像可以是PIL图像或二维数组。
+        只在内存中保留整图LL3大小的提取结果，阈值计算仍基于整幅提取结果。
+        """
+        self._check_config(watermarked_image)
+        shape = self._image_shape(watermarked_image)
+        if tuple(self._image_shape(original_image)) != tuple(shape):
+            raise ValueError("待提取图像与原始图像尺寸不一致")
+        
+        align = self._tile_alignment()
+        plan = self.config.plan(shape)
+        extracted = np.empty(plan.subband_shape, dtype=np.float32)
+        
+        for y0, x0, y1, x1 in self._iter_tiles(shape, tile_size):
+            with stage("dwt.extract_tiled.read"):
+                w_region = self._read_region(watermarked_image, y0, x0, y1, x1)
+                o_region = self._read_region(original_image, y0, x0, y1, x1)
+            with stage("dwt.extract_tiled.wavedec2"):
+                w_coeffs2 = wavedec2(w_region, plan.wavelet, plan.level, details=False)
+                o_coeffs2 = wavedec2(o_region, plan.wavelet, plan.level, details=False)
+            
+            # 直接写入整幅提取结果的对应位置
+            with stage("dwt.extract_tiled.combine"):
+                w_subbands = self._select_subbands(w_coeffs2)
+                cy, cx = y0 // align, x0 // align
+                rows, cols = w_subbands[0].shape
+                self._combine_ratios(w_subbands, self._select_subbands(o_coeffs2),
+                                     out=extracted[cy:cy + rows, cx:cx + cols])
+        
+        return self._postprocess_extracted(extracted, watermark_size)
+    
+    # ------------------------------------------------------------------
+    # 盲检测模式：基于密钥的扩频水印，提取和检测都不需要原始图像
+    #
+    # 水印二值化为 ±1 后与由密钥生成的 ±1 伪随机序列相乘，叠加到最深
+    # 一级的LH/HL子带上(小波和级数取自 config，子带和强度不受其影响)。检测时只需对待检图像做一次小波分解，再用同一
+    # 伪随机序列解扩，与目标水印计算一次相关即可。
+    # ------------------------------------------------------------------
+    def _pn_sequence(self, shape, key):
+        key = self.key if key is None else key
+        def build():
+            rng = np.random.default_rng(key)
+            return rng.integers(0, 2, size=shape, dtype=np.int8).astype(np.float32) * 2 - 1
+        return self.plane_cache.get(f"pn-{key}", shape, 'DWT_BLIND', 'pn', build)
+    
+    def _watermark_signs(self, watermark, shape):
+        # 将水印调整为子带大小并二值化为 ±1
+        def build():
+            resized = watermark.resize((shape[1], shape[0]), Image.Resampling.LANCZOS)
+            return np.where(np.array(resized) > 128, 1.0, -1.0).astype(np.float32)
+        return self.plane_cache.get(watermark, shape, 'DWT_BLIND', 'signs', build)
+    
+    def _blind_spread(self, watermark, shape, key):
+        # 已乘以强度的扩频水印，按 (水印, 尺寸, 强度, 密钥) 缓存
+        key = self.key if key is None else key
+        def build():
+            return self.blind_strength * self._watermark_signs(watermark, shape) \
+                * self._pn_sequence(shape, key)
+        return self.plane_cache.get(watermark, shape, 'DWT_BLIND', (self.blind_strength, key), build)
+    
+    BLIND_FIELDS = ('wavelet', 'level')
+    
+    def _despread(self, image, key):
+        # 一次小波分解 + 解扩，返回LH与HL解扩结果之和
+        self._check_config(image, self.BLIND_FIELDS)
+        array = self._as_array(image)
+        plan = self.config.plan(array.shape)
+        with stage("dwt.blind.wavedec2"):
+            coeffs2 = plan.decompose(array, details=False)
+        del array
+        LH3, HL3, _ = coeffs2[1]
+        # 在LH3的缓冲区中原地完成求和与解扩
+        with stage("dwt.blind.despread"):
+            LH3 += HL3
+            LH3 *= self._pn_sequence(LH3.shape, key)
+        return LH3
+    
+    def embed_blind(self, host_image, watermark, key=None):
+        """以盲检测模式嵌入水印，key 为空时使用 self.key"""
+        if self._is_color(host_image):
+            return attach_config(self._embed_luma(host_image, lambda luma: self.embed_blind(luma, watermark, key)),
+                                 self.config)
+        
+        host_array = np.asarray(host_image)
+        height, width = host_array.shape
+        plan = self.config.plan(host_array.shape)
+        with stage("dwt.embed_blind.wavedec2"):
+            coeffs2 = plan.decompose(host_array)
+        del host_array
+        (LH3, HL3, HH3) = coeffs2[1]
+        
+        with stage("dwt.embed_blind.spread"):
+            spread = self._blind_spread(watermark, LH3.shape, key)
+            LH3 += spread
+            HL3 += spread
+        
+        with stage("dwt.embed_blind.waverec2"):
+            watermarked = plan.reconstruct(coeffs2)[:height, :width]
+        del coeffs2
+        
+        # 不再做平滑处理，避免削弱扩频信号；四舍五入以减少量化误差
+        np.rint(watermarked, out=watermarked)
+        np.clip(watermarked, 0, 255, out=watermarked)
+        return attach_config(Image.fromarray(watermarked.astype(np.uint8)), self.config)
+    
+    def extract_blind(self, watermarked_image, watermark_size, key=None):
+        """不依赖原始图像提取水印"""
+        despread = self._despread(watermarked_image, key)
+        
+        # 缩小到水印尺寸时按区域平均，相当于对扩频信号做积分
+        with stage("dwt.extract_blind.resize"):
+            despread_image = Image.fromarray(despread)
+            despread = np.array(despread_image.resize(watermark_size, Image.Resampling.BOX))
+        
+        extracted = np.where(despread > 0, 255, 0).astype(np.uint8)
+        return Image.fromarray(extracted)
+    
+    def detect_blind(self, image, watermark, key=None):
+        """
+        盲检测：返回 (是否检测到, 相关系数)。
+        判定使用相关系数对应的z值(相关系数 * sqrt(样本数))与 blind_threshold 比较，
+        与图像尺寸无关地控制误检率。
+        """
+        despread = self._despread(image, key)
+        with stage("dwt.detect_blind.resize"):
+            signs = self._watermark_signs(watermark, despread.shape).ravel()
+        
+        with stage("dwt.detect_blind.correlate"):
+            despread = despread.ravel()
+            despread = despread - despread.mean()
+            signs = signs - signs.mean()
+            norm = np.linalg.norm(despread) * np.linalg.norm(signs)
+            if norm == 0:
+                return False, 0.0
+            correlation = float(np.dot(despread, signs) / norm)
+        
+        z_score = correlation * np.sqrt(despread.size)
+        return bool(z_score > self.blind_threshold), correlation
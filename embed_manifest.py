@@ -0,0 +1,177 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(path=None, data=None):
+    """文件(或已读入的字节数据)内容的blake2b哈希"""
+    digest = hashlib.blake2b(digest_size=20)
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ManifestEntry:
+    """清单中的一条记录：一个输出图像及其输入"""
+
+    FIELDS = ('input_path', 'input_hash', 'input_size', 'input_mtime_ns', 'watermark_id',
+              'algorithm', 'params', 'output_path', 'output_hash', 'embedded_at',
+              'verified_at', 'verify_status', 'verify_score')
+
+    def __init__(self, row):
+        for field, value in zip(self.FIELDS, row):
+            setattr(self, field, value)
+
+    def same_job(self, watermark_id, algorithm, params, output_path):
+        return (self.watermark_id == watermark_id and self.algorithm == algorithm
+                and self.params == params and self.output_path == output_path)
+
+
+class EmbedManifest:
+    """
+    批量嵌入的清单，保存在一个SQLite数据库文件中。
+
+    每个输出图像一行(以输出路径为主键)，记录输入路径、输入内容哈希、水印标识、
+    算法、参数和输出内容哈希；同一输入用不同算法或水印嵌入到不同输出时各占
+    一行，互不覆盖。重新运行时用 is_current 判断输出是否需要重新嵌入：输入的
+    文件大小和修改时间都没变时直接认为未变化，否则重新计算内容哈希比较，因此
+    只是被touch过的文件也不会重新嵌入。路径统一保存为绝对路径。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outputs (
+            input_path      TEXT NOT NULL,
+            input_hash      TEXT NOT NULL,
+            input_size      INTEGER NOT NULL,
+            input_mtime_ns  INTEGER NOT NULL,
+            watermark_id    TEXT NOT NULL,
+            algorithm       TEXT NOT NULL,
+            params          TEXT NOT NULL,
+            output_path     TEXT PRIMARY KEY,
+            output_hash     TEXT NOT NULL,
+            embedded_at     REAL NOT NULL,
+            verified_at     REAL,
+            verify_status   TEXT,
+            verify_score    REAL
+        )
+    """
+    INDEX = "CREATE INDEX IF NOT EXISTS outputs_input_path ON outputs (input_path)"
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._upgrade()
+        self._conn.execute(self.SCHEMA)
+        self._conn.execute("DROP INDEX IF EXISTS outputs_output_path")
+        self._conn.execute(self.INDEX)
+        self._conn.commit()
+
+    def _upgrade(self):
+        # 旧版清单以输入路径为主键(每个输入只有一行)，迁移为以输出路径为主键
+        columns = {row[1]: row[5] for row in self._conn.execute("PRAGMA table_info(outputs)")}
+        if not columns.get('input_path'):
+            return
+        self._conn.execute("ALTER TABLE outputs RENAME TO outputs_old")
+        self._conn.execute(self.SCHEMA)
+        self._conn.execute(f"INSERT OR REPLACE INTO outputs SELECT {', '.join(ManifestEntry.FIELDS)} "
+                           "FROM outputs_old")
+        self._conn.execute("DROP TABLE outputs_old")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+
+    def get(self, output_path):
+        row = self._conn.execute("SELECT * FROM outputs WHERE output_path = ?",
+                                 (os.path.abspath(output_path),)).fetchone()
+        return ManifestEntry(row) if row is not None else None
+
+    def entries(self, input_path=None):
+        """全部记录，或某个输入的全部输出"""
+        if input_path is None:
+            rows = self._conn.execute("SELECT * FROM outputs ORDER BY input_path, output_path")
+        else:
+            rows = self._conn.execute("SELECT * FROM outputs WHERE input_path = ? ORDER BY output_path",
+                                      (os.path.abspath(input_path),))
+        return [ManifestEntry(row) for row in rows]
+
+    def owner(self, output_path, exclude=None):
+        """返回清单中记录了该输出路径的输入路径(排除 exclude)，没有时返回 None"""
+        row = self._conn.execute("SELECT input_path FROM outputs WHERE output_path = ? AND input_path != ?",
+                                 (os.path.abspath(output_path),
+                                  os.path.abspath(exclude) if exclude is not None else '')).fetchone()
+        return row[0] if row is not None else None
+
+    def is_current(self, input_path, watermark_id, algorithm, params, output_path):
+        """
+        输出是否已由该输入用相同水印、算法和参数嵌入过，且输出文件仍然存在。
+        只有大小或修改时间变化时才读取文件计算哈希。
+        """
+        entry = self.get(output_path)
+        output_path = os.path.abspath(output_path)
+        if (entry is None or entry.input_path != os.path.abspath(input_path)
+                or not entry.same_job(watermark_id, algorithm, params, output_path)):
+            return False
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False
+        if not os.path.exists(output_path):
+            return False
+        if stat.st_size == entry.input_size and stat.st_mtime_ns == entry.input_mtime_ns:
+            return True
+        if file_digest(input_path) != entry.input_hash:
+            return False
+        # 内容未变，只更新文件状态(该输入中哈希相同的各条记录)，下次无需再计算哈希
+        self._conn.execute("UPDATE outputs SET input_size = ?, input_mtime_ns = ? "
+                           "WHERE input_path = ? AND input_hash = ?",
+                           (stat.st_size, stat.st_mtime_ns, entry.input_path, entry.input_hash))
+        self._conn.commit()
+        return True
+
+    def record(self, input_path, input_hash, input_size, input_mtime_ns, watermark_id,
+               algorithm, params, output_path, output_hash):
+        """
+        记录一次成功的嵌入，覆盖该输出之前的记录(包括校验结果)。
+        输出路径已属于清单中另一个输入时抛出 ValueError。
+        """
+        owner = self.owner(output_path, exclude=input_path)
+        if owner is not None:
+            raise ValueError(f"输出文件 {output_path} 已属于清单中的输入 {owner}")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, NULL)",
+            (os.path.abspath(input_path), input_hash, input_size, input_mtime_ns, watermark_id,
+             algorithm, params, os.path.abspath(output_path), output_hash, time.time()))
+        self._conn.commit()
+
+    def sample(self, count, watermark_id=None):
+        """随机抽取至多 count 条记录，可只抽取指定水印的记录"""
+        if watermark_id is None:
+            rows = self._conn.execute("SELECT * FROM outputs ORDER BY RANDOM() LIMIT ?", (count,))
+        else:
+            rows = self._conn.execute("SELECT * FROM outputs WHERE watermark_id = ? "
+                                      "ORDER BY RANDOM() LIMIT ?", (watermark_id, count))
+        return [ManifestEntry(row) for row in rows]
+
+    def mark_verified(self, output_path, status, score=None):
+        self._conn.execute("UPDATE outputs SET verified_at = ?, verify_status = ?, verify_score = ? "
+                           "WHERE output_path = ?",
+                           (time.time(), status, score, os.path.abspath(output_path)))
+        self._conn.commit()
@@ -2,12 +2,23 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 
+import numpy as np
+
+from algorithms import get_algorithm
+from dwt_config import save_image
+from image_io import as_host_image
 from watermark_generator import WatermarkGenerator
-from lsb_watermark import LSBWatermark
-from dwt_watermark import DWTWatermark
 from watermark_detector import WatermarkDetector
 
+PREVIEW_SIZE = (200, 200)
+PREVIEW_CACHE_SIZE = 32
+# 超过该像素数的载体按块嵌入，取消任务时在下一块开始前停止
+LARGE_IMAGE_PIXELS = 4096 * 4096
+
 class WatermarkGUI:
     def __init__(self, root):
         self.root = root
@@ -15,8 +26,8 @@ class WatermarkGUI:
         
         # 初始化组件
         self.generator = WatermarkGenerator()
-        self.lsb_watermark = LSBWatermark()
-        self.dwt_watermark = DWTWatermark()
+        # 算法实例在第一次使用时才创建，见 lsb_watermark / dwt_watermark 属性
+        self._algorithms = {}
         self.detector = WatermarkDetector()
         
         # 存储路径和图像
@@ -28,7 +39,27 @@ class WatermarkGUI:
         self.to_extract_image = None
         self.to_detect_image = None  # 新增：用于存储待检测的图像
         
+        # 后台任务：计算放到工作线程中执行，主线程通过 root.after 轮询结果
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+        # 按 (路径, 修改时间, 模式) 缓存的文件预览缩略图
+        self._preview_cache = OrderedDict()
+        
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        
+    def _algorithm(self, name):
+        if name not in self._algorithms:
+            self._algorithms[name] = get_algorithm(name)
+        return self._algorithms[name]
+    
+    @property
+    def lsb_watermark(self):
+        return self._algorithm("LSB")
+    
+    @property
+    def dwt_watermark(self):
+        return self._algorithm("DWT")
         
     def create_widgets(self):
         # 创建主框架
@@ -84,6 +115,8 @@ class WatermarkGUI:
                        value="LSB").grid(row=0, column=1)
         ttk.Radiobutton(embed_frame, text="DWT", variable=self.algorithm_var, 
                        value="DWT").grid(row=0, column=2)
+        ttk.Radiobutton(embed_frame, text="DWT盲检测", variable=self.algorithm_var, 
+                       value="DWT_BLIND").grid(row=0, column=3)
         
         ttk.Button(embed_frame, text="选择载体图像", 
                   command=self.load_host_image).grid(row=1, column=0, columnspan=3, pady=5)
@@ -112,6 +145,18 @@ class WatermarkGUI:
         ttk.Button(detect_frame, text="水印检测", 
                   command=self.detect_watermark).grid(row=2, column=0, pady=5)
         
+        # 5. 任务状态：进度条、状态文字和取消按钮
+        status_frame = ttk.Frame(left_frame, padding="5")
+        status_frame.grid(row=4, column=0, pady=5, sticky=(tk.W, tk.E))
+        
+        self.progress = ttk.Progressbar(status_frame, mode="indeterminate", length=150)
+        self.progress.grid(row=0, column=0, padx=2)
+        self.cancel_button = ttk.Button(status_frame, text="取消", 
+                                        command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=2)
+        self.status_label = ttk.Label(status_frame, text="就绪")
+        self.status_label.grid(row=1, column=0, columnspan=2, sticky=tk.W)
+        
         # 在右侧区域创建图像预览框架
         preview_frame = ttk.LabelFrame(right_frame, text="图像预览", padding="5")
         preview_frame.grid(row=0, column=0, sticky=(tk.N, tk.S))
@@ -136,68 +181,186 @@ class WatermarkGUI:
         self.result_filename_label = ttk.Label(preview_frame, text="结果图像: 未生成")
         self.result_filename_label.grid(row=5, column=0, pady=2)
         
+    @staticmethod
+    def _open_host_image(path):
+        """打开载体类图像：彩色图像保留为RGB，直接在彩色图像上嵌入/提取"""
+        return as_host_image(Image.open(path))
+    
+    @staticmethod
+    def _open_watermark_image(path):
+        return Image.open(path).convert('L')
+    
+    # ------------------------------------------------------------------
+    # 预览：只生成一次缩小后的缩略图，不再复制整幅图像后 thumbnail()
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _make_preview(image):
+        # reduce() 按整数倍快速缩小并返回新图像，原图保持不变
+        factor = max(1, min(image.size[0] // PREVIEW_SIZE[0], image.size[1] // PREVIEW_SIZE[1]))
+        preview = image.reduce(factor) if factor > 1 else image.copy()
+        preview.thumbnail(PREVIEW_SIZE)
+        return preview
+    
+    def _file_preview(self, path, image):
+        """返回文件的预览缩略图，同一文件未修改时直接使用缓存(在工作线程中调用)"""
+        key = (path, os.path.getmtime(path), image.mode)
+        preview = self._preview_cache.get(key)
+        if preview is None:
+            preview = self._make_preview(image)
+            self._preview_cache[key] = preview
+            while len(self._preview_cache) > PREVIEW_CACHE_SIZE:
+                self._preview_cache.popitem(last=False)
+        else:
+            self._preview_cache.move_to_end(key)
+        return preview
+    
+    @staticmethod
+    def _show_preview(label, preview):
+        photo = ImageTk.PhotoImage(preview)
+        label.configure(image=photo)
+        label.image = photo
+    
+    # ------------------------------------------------------------------
+    # 后台任务
+    # ------------------------------------------------------------------
+    def _run_task(self, description, func, on_done):
+        """
+        在工作线程中执行 func(cancelled)，完成后在主线程中调用 on_done(结果)。
+        cancelled 为取消时设置的 threading.Event，func 应在产生副作用前检查；
+        写文件等副作用放在 on_done 中。同一时间只运行一个任务；func 中不能
+        访问任何Tk控件。
+        """
+        if self._task is not None:
+            messagebox.showwarning("提示", "请等待当前任务完成或先取消")
+            return
+        cancelled = threading.Event()
+        future = self.executor.submit(func, cancelled)
+        self._task = (future, on_done, cancelled)
+        self.status_label.configure(text=f"{description}...")
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.progress.start(10)
+        self.root.after(50, self._poll_task)
+    
+    def _poll_task(self):
+        if self._task is None:
+            return
+        future, on_done, cancelled = self._task
+        if not future.done():
+            self.root.after(50, self._poll_task)
+            return
+        self._finish_task("就绪")
+        if cancelled.is_set():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            messagebox.showerror("错误", f"{type(e).__name__}: {e}")
+            return
+        on_done(result)
+    
+    def _finish_task(self, status):
+        self._task = None
+        self.progress.stop()
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.status_label.configure(text=status)
+    
+    def cancel_task(self):
+        """
+        取消当前任务：界面立即恢复。分块处理的大图在下一块开始前停止，
+        其他计算结束后结果被丢弃，on_done 不会执行，因此不会写出文件。
+        """
+        if self._task is None:
+            return
+        future, _, cancelled = self._task
+        cancelled.set()
+        future.cancel()
+        self._finish_task("已取消")
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+    
+    def _load_image(self, description, path, opener, on_loaded):
+        # 解码和生成缩略图都在后台完成
+        def work(cancelled):
+            image = opener(path)
+            return image, self._file_preview(path, image)
+        self._run_task(description, work, lambda result: on_loaded(*result))
+        
     def load_host_image(self):
-        self.host_image_path = filedialog.askopenfilename(
+        path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.bmp *.gif *.tiff")])
-        if self.host_image_path:
-            self.host_image = Image.open(self.host_image_path).convert('L')
-            display_image = self.host_image.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.host_label.configure(image=photo)
-            self.host_label.image = photo
-            # 显示文件名
-            filename = os.path.basename(self.host_image_path)
-            self.host_filename_label.configure(text=f"载体图像: {filename}")
+        if path:
+            def on_loaded(image, preview):
+                self.host_image_path = path
+                self.host_image = image
+                self._show_preview(self.host_label, preview)
+                # 显示文件名
+                filename = os.path.basename(path)
+                self.host_filename_label.configure(text=f"载体图像: {filename}")
+            self._load_image("正在加载载体图像", path, self._open_host_image, on_loaded)
             
     def load_watermark(self):
-        self.watermark_path = filedialog.askopenfilename(
+        path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.bmp *.gif *.tiff")])
-        if self.watermark_path:
-            self.original_watermark = Image.open(self.watermark_path).convert('L')
-            display_image = self.original_watermark.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.watermark_label.configure(image=photo)
-            self.watermark_label.image = photo
-            # 显示文件名
-            filename = os.path.basename(self.watermark_path)
-            self.watermark_filename_label.configure(text=f"水印图像: {filename}")
+        if path:
+            def on_loaded(image, preview):
+                self.watermark_path = path
+                self.original_watermark = image
+                self._show_preview(self.watermark_label, preview)
+                # 显示文件名
+                filename = os.path.basename(path)
+                self.watermark_filename_label.configure(text=f"水印图像: {filename}")
+            self._load_image("正在加载水印图像", path, self._open_watermark_image, on_loaded)
             
     def load_extract_image(self):
         extract_path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.bmp *.gif *.tiff")])
         if extract_path:
-            self.to_extract_image = Image.open(extract_path).convert('L')
-            display_image = self.to_extract_image.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.host_label.configure(image=photo)
-            self.host_label.image = photo
+            def on_loaded(image, preview):
+                self.to_extract_image = image
+                self._show_preview(self.host_label, preview)
+            self._load_image("正在加载待提取图像", extract_path, self._open_host_image, on_loaded)
             
     def load_detect_image(self):
         """加载待检测的图像"""
         detect_path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.bmp *.gif *.tiff")])
         if detect_path:
-            self.to_detect_image = Image.open(detect_path).convert('L')
-            display_image = self.to_detect_image.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.host_label.configure(image=photo)
-            self.host_label.image = photo
+            def on_loaded(image, preview):
+                self.to_detect_image = image
+                self._show_preview(self.host_label, preview)
+            self._load_image("正在加载待检测图像", detect_path, self._open_host_image, on_loaded)
     
     def load_target_watermark(self):
         """加载目标水印图像"""
         target_path = filedialog.askopenfilename(
             filetypes=[("Image files", "*.png *.jpg *.bmp *.gif *.tiff")])
         if target_path:
-            self.target_watermark = Image.open(target_path).convert('L')
-            display_image = self.target_watermark.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.watermark_label.configure(image=photo)
-            self.watermark_label.image = photo
+            def on_loaded(image, preview):
+                self.target_watermark = image
+                self._show_preview(self.watermark_label, preview)
+            self._load_image("正在加载目标水印", target_path, self._open_watermark_image, on_loaded)
+    
+    def _embed(self, algorithm, host_image, watermark, cancelled):
+        """在工作线程中嵌入水印；大图走分块路径，取消后在下一块开始前停止"""
+        if cancelled.is_set():
+            raise CancelledError()
+        large = host_image.size[0] * host_image.size[1] >= LARGE_IMAGE_PIXELS
+        if algorithm == "LSB":
+            if large:
+                host_array = np.array(host_image)
+                return Image.fromarray(self.lsb_watermark.embed_inplace(host_array, watermark, cancel=cancelled))
+            return self.lsb_watermark.embed(host_image, watermark)
+        if algorithm == "DWT_BLIND":
+            return self.dwt_watermark.embed_blind(host_image, watermark)
+        # 分块模式只支持灰度图像和haar小波；宽高按 2**level 对齐时结果与整图嵌入一致
+        config = self.dwt_watermark.config
+        align = 2 ** config.level
+        if (large and host_image.mode == 'L' and config.wavelet == 'haar'
+                and host_image.size[0] % align == 0 and host_image.size[1] % align == 0):
+            return self.dwt_watermark.embed_tiled(host_image, watermark, cancel=cancelled)
+        return self.dwt_watermark.embed(host_image, watermark)
     
     def embed_watermark(self):
         if not self.host_image_path or not self.watermark_path:
@@ -205,22 +368,26 @@ class WatermarkGUI:
             return
             
         algorithm = self.algorithm_var.get()
-        if algorithm == "LSB":
-            self.watermarked_image = self.lsb_watermark.embed(self.host_image, self.original_watermark)
-        else:
-            self.watermarked_image = self.dwt_watermark.embed(self.host_image, self.original_watermark)
-            
-        display_image = self.watermarked_image.copy()
-        display_image.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(display_image)
-        self.result_label.configure(image=photo)
-        self.result_label.image = photo
-        
+        host_image = self.host_image
+        watermark = self.original_watermark
         # 生成带算法标识的文件名
         output_filename = f"watermarked_image_{algorithm}.png"
-        self.watermarked_image.save(output_filename)
-        self.result_filename_label.configure(text=f"结果图像: {output_filename}")
-        messagebox.showinfo("成功", f"水印已嵌入并保存为{output_filename}")
+        
+        def work(cancelled):
+            watermarked = self._embed(algorithm, host_image, watermark, cancelled)
+            if cancelled.is_set():
+                raise CancelledError()
+            return watermarked, self._make_preview(watermarked)
+        
+        def on_done(result):
+            self.watermarked_image, preview = result
+            # 在主线程中保存，已取消的任务不会执行到这里；DWT结果同时保存嵌入配置，提取时据此校验
+            save_image(self.watermarked_image, output_filename)
+            self._show_preview(self.result_label, preview)
+            self.result_filename_label.configure(text=f"结果图像: {output_filename}")
+            messagebox.showinfo("成功", f"水印已嵌入并保存为{output_filename}")
+        
+        self._run_task("正在嵌入水印", work, on_done)
         
     def extract_watermark(self):
         if not self.to_extract_image:
@@ -233,26 +400,35 @@ class WatermarkGUI:
             
         watermark_size = self.original_watermark.size
         algorithm = self.algorithm_var.get()
+        image = self.to_extract_image
+        host_image = self.host_image
         
-        if algorithm == "LSB":
-            extracted = self.lsb_watermark.extract(self.to_extract_image, watermark_size)
-        else:
-            if not self.host_image:
-                messagebox.showerror("错误", "DWT算法需要选择原始载体图像")
-                return
-            extracted = self.dwt_watermark.extract(self.to_extract_image, self.host_image, watermark_size)
-            
-        display_image = extracted.copy()
-        display_image.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(display_image)
-        self.result_label.configure(image=photo)
-        self.result_label.image = photo
+        if algorithm == "DWT" and not host_image:
+            messagebox.showerror("错误", "DWT算法需要选择原始载体图像")
+            return
         
         # 生成带算法标识的文件名
         output_filename = f"extracted_watermark_{algorithm}.png"
-        extracted.save(output_filename)
-        self.result_filename_label.configure(text=f"结果图像: {output_filename}")
-        messagebox.showinfo("成功", f"水印已提取并保存为{output_filename}")
+        
+        def work(cancelled):
+            if algorithm == "LSB":
+                extracted = self.lsb_watermark.extract(image, watermark_size)
+            elif algorithm == "DWT_BLIND":
+                extracted = self.dwt_watermark.extract_blind(image, watermark_size)
+            else:
+                extracted = self.dwt_watermark.extract(image, host_image, watermark_size)
+            if cancelled.is_set():
+                raise CancelledError()
+            return extracted, self._make_preview(extracted)
+        
+        def on_done(result):
+            extracted, preview = result
+            extracted.save(output_filename)
+            self._show_preview(self.result_label, preview)
+            self.result_filename_label.configure(text=f"结果图像: {output_filename}")
+            messagebox.showinfo("成功", f"水印已提取并保存为{output_filename}")
+        
+        self._run_task("正在提取水印", work, on_done)
         
     def detect_watermark(self):
         """检测图像中是否包含目标水印"""
@@ -264,32 +440,41 @@ class WatermarkGUI:
             messagebox.showerror("错误", "请先选择目标水印")
             return
         
-        # 从待检测图像中提取水印
-        watermark_size = self.target_watermark.size
-        
-        if self.algorithm_var.get() == "LSB":
-            extracted = self.lsb_watermark.extract(self.to_detect_image, watermark_size)
-        else:
+        algorithm = self.algorithm_var.get()
+        if algorithm == "DWT":
             # DWT算法需要原始图像，这里可能需要调整检测策略
-            messagebox.showerror("错误", "当前版本DWT算法不支持直接检测")
+            messagebox.showerror("错误", "当前版本DWT算法不支持直接检测，请使用DWT盲检测模式")
             return
+        
+        # 从待检测图像中提取水印
+        image = self.to_detect_image
+        target = self.target_watermark
+        watermark_size = target.size
+        
+        def work(cancelled):
+            if algorithm == "LSB":
+                extracted = self.lsb_watermark.extract(image, watermark_size)
+                # 检测提取的水印与目标水印的相似度
+                is_detected, correlation = self.detector.detect(target, extracted)
+            else:
+                # 盲检测模式不需要原始图像，直接在小波域做相关检测
+                extracted = self.dwt_watermark.extract_blind(image, watermark_size)
+                is_detected, correlation = self.dwt_watermark.detect_blind(image, target)
+            return self._make_preview(extracted), is_detected, correlation
+        
+        def on_done(result):
+            preview, is_detected, correlation = result
+            # 显示提取的水印
+            self._show_preview(self.result_label, preview)
             
-        # 检测提取的水印与目标水印的相似度
-        is_detected, correlation = self.detector.detect(self.target_watermark, extracted)
-        
-        # 显示提取的水印
-        display_image = extracted.copy()
-        display_image.thumbnail((200, 200))
-        photo = ImageTk.PhotoImage(display_image)
-        self.result_label.configure(image=photo)
-        self.result_label.image = photo
-        
-        if is_detected:
-            message = f"检测到目标水印！\n相关系数: {correlation:.3f}"
-        else:
-            message = f"未检测到目标水印\n相关系数: {correlation:.3f}"
-            
-        messagebox.showinfo("检测结果", message)
+            if is_detected:
+                message = f"检测到目标水印！\n相关系数: {correlation:.3f}"
+            else:
+                message = f"未检测到目标水印\n相关系数: {correlation:.3f}"
+                
+            messagebox.showinfo("检测结果", message)
+        
+        self._run_task("正在检测水印", work, on_done)
     
     def generate_watermark(self):
         try:
@@ -322,11 +507,7 @@ class WatermarkGUI:
             self.original_watermark = Image.fromarray(watermark)
             
             # 显示生成的水印
-            display_image = self.original_watermark.copy()
-            display_image.thumbnail((200, 200))
-            photo = ImageTk.PhotoImage(display_image)
-            self.watermark_label.configure(image=photo)
-            self.watermark_label.image = photo
+            self._show_preview(self.watermark_label, self._make_preview(self.original_watermark))
             
             # 生成带类型标识的文件名
             output_filename = f"generated_watermark_{type_str}.png"
@@ -0,0 +1,42 @@
+from PIL import Image
+
+from dwt_config import CONFIG_KEY, attach_config, read_config
+
+# 载体图像的统一打开方式，图形界面、批量嵌入和水印服务共用
+#
+# 彩色图像保留为RGB/RGBA，直接在彩色图像上嵌入/提取；调色板图像(GIF、
+# 调色板PNG)只有实际用到的颜色都是灰色时才转为灰度，否则按是否带透明度
+# 转为RGBA或RGB；其余单通道图像转为灰度。转换后的图像不再带有文件名，
+# 因此在转换时把 .dwt.json 附属文件中的DWT配置一并附加到结果上，
+# 提取时仍能校验BMP/TIFF等格式的嵌入配置。
+
+
+def _uses_grey_palette(image):
+    # 只检查图像中实际出现的调色板索引，未使用的彩色条目不影响结果
+    indices = image if image.mode == 'P' else image.getchannel(0)
+    palette = image.getpalette() or []
+    for _, index in indices.getcolors(256):
+        red, green, blue = palette[index * 3:index * 3 + 3] or (0, 0, 0)
+        if not red == green == blue:
+            return False
+    return True
+
+
+def as_host_image(image):
+    """把PIL图像转换为载体使用的模式(L、RGB或RGBA)，保留图像携带的DWT配置"""
+    converted = _convert(image)
+    if CONFIG_KEY not in converted.info:
+        config = read_config(image)
+        if config is not None:
+            attach_config(converted, config)
+    return converted
+
+
+def _convert(image):
+    if image.mode in ('P', 'PA') and not _uses_grey_palette(image):
+        has_alpha = image.mode == 'PA' or 'transparency' in image.info
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    bands = image.getbands()
+    if len(bands) >= 3:
+        return image.convert('RGBA' if 'A' in bands else 'RGB')
+    return image.convert('L')
@@ -0,0 +1,248 @@
+import contextlib
+import io
+import os
+import threading
+import time
+import tracemalloc
+
+# 各算法阶段的计时和内存分配统计，默认关闭
+#
+# 代码中用 `with stage("dwt.embed.wavedec2"):` 标记阶段。关闭时 stage() 只检查
+# 一个全局标志并返回共享的空上下文，开销可以忽略。enable() 打开计时；
+# enable(memory=True) 同时启动 tracemalloc，记录每个阶段净分配的字节数和
+# 阶段内的内存峰值(嵌套阶段的峰值会计入外层阶段)。tracemalloc 只能看到
+# numpy 和 Python 对象的分配，看不到PIL内部的图像缓冲区，并且会明显拖慢
+# 运行，只在需要时打开。也可以设置环境变量 WATERMARK_INSTRUMENT=1
+# (或 =memory)，在导入时打开，便于在子进程中使用。
+#
+# 统计结果可用 snapshot() 取得字典，或用 prometheus_text() 输出为
+# Prometheus 文本格式。capture() 在 cProfile/tracemalloc 下运行单次调用。
+
+_enabled = False
+_memory = False
+_started_tracemalloc = False
+_stats = {}
+_lock = threading.Lock()
+_local = threading.local()
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class StageStats:
+    """单个阶段的累计统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.allocated_bytes = 0
+        self.peak_bytes = 0
+
+    def to_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds, 'max_seconds': self.max_seconds,
+                'allocated_bytes': self.allocated_bytes, 'peak_bytes': self.peak_bytes}
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'memory_start', 'memory_peak')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _memory:
+            stack = _stack()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # 重置峰值前先把之前的峰值计入外层阶段
+                stack[-1].memory_peak = max(stack[-1].memory_peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.memory_peak = current
+            stack.append(self)
+        else:
+            self.memory_start = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        allocated = peak = 0
+        if self.memory_start is not None and tracemalloc.is_tracing():
+            stack = _stack()
+            current, traced_peak = tracemalloc.get_traced_memory()
+            self.memory_peak = max(self.memory_peak, traced_peak)
+            allocated = current - self.memory_start
+            peak = self.memory_peak - self.memory_start
+            if stack and stack[-1] is self:
+                stack.pop()
+            if stack:
+                stack[-1].memory_peak = max(stack[-1].memory_peak, self.memory_peak)
+        with _lock:
+            stats = _stats.get(self.name)
+            if stats is None:
+                stats = _stats[self.name] = StageStats()
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.allocated_bytes += allocated
+            stats.peak_bytes = max(stats.peak_bytes, peak)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def stage(name):
+    """标记一个阶段，统计关闭时返回空上下文"""
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(memory=False):
+    """打开阶段统计，memory=True 时同时统计内存分配(启动 tracemalloc)"""
+    global _enabled, _memory, _started_tracemalloc
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _memory = memory
+    _enabled = True
+
+
+def disable():
+    global _enabled, _memory, _started_tracemalloc
+    _enabled = False
+    _memory = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    """返回 {阶段名: {calls, seconds, max_seconds, allocated_bytes, peak_bytes}}"""
+    with _lock:
+        return {name: stats.to_dict() for name, stats in sorted(_stats.items())}
+
+
+_METRICS = (
+    ('calls', 'watermark_stage_calls_total', 'counter', "阶段调用次数"),
+    ('seconds', 'watermark_stage_seconds_total', 'counter', "阶段累计耗时(秒)"),
+    ('max_seconds', 'watermark_stage_max_seconds', 'gauge', "阶段单次最长耗时(秒)"),
+    ('allocated_bytes', 'watermark_stage_allocated_bytes_total', 'counter', "阶段净分配字节数"),
+    ('peak_bytes', 'watermark_stage_peak_bytes', 'gauge', "阶段内存峰值(字节)"),
+)
+
+
+def prometheus_text(stats=None):
+    """把统计结果(默认为当前统计)输出为 Prometheus 文本格式"""
+    if stats is None:
+        stats = snapshot()
+    lines = []
+    for field, metric, kind, description in _METRICS:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, values in stats.items():
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append(f'{metric}{{stage="{label}"}} {values[field]:g}')
+    return "\n".join(lines) + "\n"
+
+
+def format_stages(stats=None):
+    """按耗时从高到低排列的阶段统计表"""
+    if stats is None:
+        stats = snapshot()
+    lines = [f"{'阶段':<32} {'次数':>6} {'总耗时(ms)':>12} {'平均(ms)':>10} {'分配(MB)':>10} {'峰值(MB)':>10}"]
+    for name, values in sorted(stats.items(), key=lambda item: -item[1]['seconds']):
+        lines.append(f"{name:<32} {values['calls']:>6} {values['seconds'] * 1e3:>12.2f} "
+                     f"{values['seconds'] * 1e3 / max(values['calls'], 1):>10.2f} "
+                     f"{values['allocated_bytes'] / 2**20:>10.1f} {values['peak_bytes'] / 2**20:>10.1f}")
+    return "\n".join(lines)
+
+
+class Capture:
+    """
+    capture() 的结果：调用返回值、cProfile统计、阶段统计，以及调用期间的
+    内存峰值和调用结束时仍保留的分配最多的代码行
+    """
+
+    def __init__(self, result, profile, memory, stages, peak_bytes=0):
+        self.result = result
+        self.profile = profile
+        self.memory = memory
+        self.stages = stages
+        self.peak_bytes = peak_bytes
+
+    def report(self, sort='cumulative', limit=25):
+        import pstats
+
+        buffer = io.StringIO()
+        if self.stages:
+            buffer.write(format_stages(self.stages) + "\n\n")
+        if self.profile is not None:
+            pstats.Stats(self.profile, stream=buffer).sort_stats(sort).print_stats(limit)
+        if self.peak_bytes:
+            buffer.write(f"调用期间内存峰值: {self.peak_bytes / 2**20:.1f} MB\n")
+        if self.memory:
+            buffer.write("调用结束时仍保留的分配最多的代码行:\n")
+            for line in self.memory[:limit]:
+                buffer.write(f"  {line}\n")
+        return buffer.getvalue()
+
+
+def capture(func, *args, profile=True, memory=True, memory_limit=25, **kwargs):
+    """
+    在 cProfile(profile=True) 和 tracemalloc(memory=True) 下运行一次 func，
+    同时收集这次调用的阶段统计。调用前后的全局统计状态保持不变。
+    """
+    import cProfile
+
+    global _enabled, _memory, _stats
+    saved = (_enabled, _memory, _stats)
+    was_tracing = tracemalloc.is_tracing()
+    with _lock:
+        _stats = {}
+    _enabled, _memory = True, memory
+    if memory:
+        if not was_tracing:
+            tracemalloc.start()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if profile else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        top, peak = [], 0
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1] - memory_start
+            traced = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+            top = [str(stat) for stat in traced.statistics('lineno')[:memory_limit]]
+        stages = snapshot()
+    finally:
+        if memory and not was_tracing:
+            tracemalloc.stop()
+        with _lock:
+            _enabled, _memory, _stats = saved
+    return Capture(result, profiler, top, stages, peak)
+
+
+_env = os.environ.get('WATERMARK_INSTRUMENT', '').lower()
+if _env and _env not in ('0', 'false', 'no'):
+    enable(memory=_env == 'memory')
@@ -1,36 +1,319 @@
+import struct
+import zlib
+from concurrent.futures import CancelledError
+
 import numpy as np
 from PIL import Image
 
+from instrumentation import stage
+from mmap_io import release_pages
+from watermark_cache import default_plane_cache
+
+# 载荷模式的头部：魔数、重复次数、载荷字节数、CRC32，头部本身重复3次以便多数表决
+PAYLOAD_MAGIC = b'WM'
+PAYLOAD_HEADER = struct.Struct('>2sBxII')
+PAYLOAD_HEADER_COPIES = 3
+PAYLOAD_HEADER_BITS = PAYLOAD_HEADER.size * 8 * PAYLOAD_HEADER_COPIES
+
 class LSBWatermark:
-    def __init__(self):
-        pass
+    def __init__(self, plane_cache=None):
+        # 预处理后水印平面的缓存，默认使用进程内共享的缓存
+        self.plane_cache = plane_cache if plane_cache is not None else default_plane_cache
     
-    def embed(self, host_image, watermark):
+    def embed(self, host_image, watermark, channels=None):
         # 确保输入是numpy数组
-        host_array = np.array(host_image)
-        
-        # 将水印调整为与载体图像相同的大小
-        watermark = watermark.resize((host_array.shape[1], host_array.shape[0]), Image.Resampling.LANCZOS)
-        watermark_array = np.array(watermark)
+        with stage("lsb.embed.load"):
+            host_array = np.array(host_image)
         
-        # 将水印二值化 - 修改阈值处理逻辑
-        watermark_binary = (watermark_array > 128).astype(np.uint8)  # 修改这里，从 < 改为 >
+        # 将水印调整为与载体图像相同的大小并二值化，结果按尺寸缓存
+        with stage("lsb.embed.resize"):
+            watermark_binary = self._watermark_plane(watermark, host_array.shape[:2])
         
-        # 获取原始图像的最低位平面
-        host_lsb = host_array & 0xFE
-        
-        # 嵌入水印
-        watermarked = host_lsb | watermark_binary
+        with stage("lsb.embed.bitops"):
+            # 彩色图像在选定的通道上同时嵌入
+            if host_array.ndim == 3:
+                watermarked = self._embed_channels(host_array, watermark_binary, channels)
+            else:
+                # 获取原始图像的最低位平面
+                host_lsb = host_array & 0xFE
+                
+                # 嵌入水印
+                watermarked = host_lsb | watermark_binary
         
         return Image.fromarray(watermarked)
     
-    def extract(self, watermarked_image, watermark_size):
+    def extract(self, watermarked_image, watermark_size, channels=None):
+        with stage("lsb.extract.load"):
+            watermarked_array = np.array(watermarked_image)
+        
         # 提取最低位平面
-        watermarked_array = np.array(watermarked_image)
-        extracted = (watermarked_array & 0x01) * 255
+        with stage("lsb.extract.bitops"):
+            if watermarked_array.ndim == 3:
+                extracted = self._extract_channels(watermarked_array, channels) * 255
+            else:
+                extracted = (watermarked_array & 0x01) * 255
         
         # 调整大小以匹配原始水印尺寸
-        extracted_image = Image.fromarray(extracted.astype(np.uint8))
-        extracted_image = extracted_image.resize(watermark_size, Image.Resampling.LANCZOS)
+        with stage("lsb.extract.resize"):
+            extracted_image = Image.fromarray(extracted.astype(np.uint8))
+            extracted_image = extracted_image.resize(watermark_size, Image.Resampling.LANCZOS)
+        
+        return extracted_image
+    
+    # ------------------------------------------------------------------
+    # 原地模式：直接修改 numpy 数组/np.memmap 的最低位平面
+    #
+    # 按行分段处理，每段只为该段生成二值水印平面(对水印按对应区域做
+    # 同样的LANCZOS缩放)，不创建PIL载体图像，也不会在内存中保留整幅
+    # 载体或水印平面，配合 mmap_io 打开的文件可处理数GB的图像。二值化
+    # 结果与 embed() 相同(仅当缩放值恰好落在阈值附近时可能相差1位)。
+    # ------------------------------------------------------------------
+    ROWS_PER_CHUNK = 1024
+    
+    def _watermark_band(self, watermark, shape, y0, y1):
+        # 整幅尺寸下第 [y0, y1) 行的二值水印平面
+        scale = watermark.size[1] / shape[0]
+        band = watermark.resize((shape[1], y1 - y0), Image.Resampling.LANCZOS,
+                                box=(0, y0 * scale, watermark.size[0], y1 * scale))
+        return (np.asarray(band) > 128).astype(np.uint8)
+    
+    def embed_inplace(self, host_array, watermark, out=None, channels=None, rows_per_chunk=ROWS_PER_CHUNK,
+                      cancel=None):
+        """
+        将水印写入 host_array 的最低位平面并返回输出数组。
+        host_array 为 (H, W) 或 (H, W, C) 的uint8数组(包括np.memmap)；
+        out 省略时原地修改 host_array，否则逐段写入同形状的 out(例如
+        mmap_io.create_image 新建的输出文件)。
+        cancel 为可选的 threading.Event，每段开始前检查，已设置时抛出 CancelledError。
+        """
+        if host_array.dtype != np.uint8 or host_array.ndim not in (2, 3):
+            raise ValueError("载体必须是二维或三维的uint8数组")
+        if out is None:
+            out = host_array
+        elif out.shape != host_array.shape or out.dtype != np.uint8:
+            raise ValueError("输出数组的尺寸和类型必须与载体一致")
+        
+        height = host_array.shape[0]
+        for y0 in range(0, height, rows_per_chunk):
+            if cancel is not None and cancel.is_set():
+                raise CancelledError()
+            y1 = min(height, y0 + rows_per_chunk)
+            with stage("lsb.embed_inplace.resize"):
+                band = self._watermark_band(watermark, host_array.shape[:2], y0, y1)
+            with stage("lsb.embed_inplace.bitops"):
+                chunk = out[y0:y1]
+                if out is not host_array:
+                    chunk[...] = host_array[y0:y1]
+                if chunk.ndim == 3:
+                    self._embed_channels(chunk, band, channels)
+                else:
+                    np.bitwise_and(chunk, 0xFE, out=chunk)
+                    np.bitwise_or(chunk, band, out=chunk)
+            # 已处理的映射页交还给系统，常驻内存只保留一段
+            with stage("lsb.embed_inplace.release"):
+                release_pages(out)
+                if out is not host_array:
+                    release_pages(host_array)
+        
+        if hasattr(out, 'flush'):
+            out.flush()
+        return out
+    
+    # ------------------------------------------------------------------
+    # 彩色图像：channels 为嵌入所用的通道序号，默认使用前三个颜色通道
+    # (RGBA图像不修改alpha通道)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _channel_masks(num_channels, channels):
+        if channels is None:
+            channels = range(min(num_channels, 3))
+        selected = np.zeros(num_channels, dtype=bool)
+        selected[list(channels)] = True
+        if not selected.any():
+            raise ValueError("至少需要选择一个通道")
+        keep = np.where(selected, 0xFE, 0xFF).astype(np.uint8)
+        return selected, keep
+    
+    def _embed_channels(self, host_array, watermark_binary, channels):
+        selected, keep = self._channel_masks(host_array.shape[2], channels)
+        # 对 (H, W, C) 数组按通道掩码一次完成清位和写入，host_array 可以原地修改
+        # (embed 中是本地副本，embed_inplace 中是输出数组的一段)
+        np.bitwise_and(host_array, keep, out=host_array)
+        np.bitwise_or(host_array, watermark_binary[..., None] * selected.astype(np.uint8), out=host_array)
+        return host_array
+    
+    def _extract_channels(self, watermarked_array, channels):
+        selected, _ = self._channel_masks(watermarked_array.shape[2], channels)
+        # 各通道的最低位按多数表决合成一个平面
+        votes = (watermarked_array[..., selected] & 0x01).sum(axis=2, dtype=np.uint8)
+        return (votes * 2 >= selected.sum()).astype(np.uint8)
+    
+    # ------------------------------------------------------------------
+    # 载荷模式：把字节数据(如所有者ID、时间戳、签名)按位写入最低位
+    #
+    # 布局为 [头部 x 3][载荷 x repeat]，按行优先顺序写入载体前面的像素
+    # (彩色图像按像素内选定的通道依次写入)。提取时先读头部，再只读取
+    # 第一份载荷所需的像素；CRC校验失败且有冗余副本时，才读取全部副本
+    # 按位多数表决。
+    # ------------------------------------------------------------------
+    def payload_capacity(self, host_image, repeat=1, channels=None):
+        """返回可嵌入的最大载荷字节数"""
+        host_array = np.asarray(host_image)
+        carriers = host_array.shape[0] * host_array.shape[1]
+        if host_array.ndim == 3:
+            carriers *= int(self._channel_masks(host_array.shape[2], channels)[0].sum())
+        return max(0, (carriers - PAYLOAD_HEADER_BITS) // (8 * repeat))
+    
+    def embed_payload(self, host_image, payload, repeat=1, channels=None):
+        """将字节载荷嵌入载体，repeat 为冗余副本数(建议取奇数)"""
+        payload = bytes(payload)
+        if not 1 <= repeat <= 255:
+            raise ValueError("重复次数必须在1到255之间")
+        capacity = self.payload_capacity(host_image, repeat, channels)
+        if len(payload) > capacity:
+            raise ValueError(f"载荷长度 {len(payload)} 字节超过容量 {capacity} 字节")
+        
+        header = PAYLOAD_HEADER.pack(PAYLOAD_MAGIC, repeat, len(payload), zlib.crc32(payload))
+        data = header * PAYLOAD_HEADER_COPIES + payload * repeat
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+        
+        host_array = np.array(host_image)
+        with stage("lsb.embed_payload.bitops"):
+            if host_array.ndim == 3:
+                selected, _ = self._channel_masks(host_array.shape[2], channels)
+                carrier = host_array[..., selected].reshape(-1)
+                carrier[:bits.size] = (carrier[:bits.size] & 0xFE) | bits
+                host_array[..., selected] = carrier.reshape(host_array.shape[:2] + (-1,))
+            else:
+                carrier = host_array.reshape(-1)
+                carrier[:bits.size] = (carrier[:bits.size] & 0xFE) | bits
+        return Image.fromarray(host_array)
+    
+    def _read_bits(self, image, start, count, channels):
+        with stage("lsb.extract_payload.read"):
+            return self._read_region_bits(image, start, count, channels)
+    
+    def _read_region_bits(self, image, start, count, channels):
+        # 只读取覆盖 [start, start+count) 这些位所需的前若干行
+        if isinstance(image, Image.Image):
+            width, height = image.size
+            bands = len(image.getbands())
+        else:
+            height, width = image.shape[:2]
+            bands = image.shape[2] if image.ndim == 3 else 1
+        
+        if bands > 1:
+            selected, _ = self._channel_masks(bands, channels)
+            per_row = width * int(selected.sum())
+        else:
+            selected, per_row = None, width
+        rows = min(height, -(-(start + count) // per_row))
+        
+        if isinstance(image, Image.Image):
+            region = np.asarray(image.crop((0, 0, width, rows)))
+        else:
+            region = np.asarray(image[:rows])
+        if selected is not None:
+            region = region[..., selected]
+        
+        bits = region.reshape(-1)[start:start + count] & 0x01
+        if bits.size < count:
+            raise ValueError("图像中没有足够的像素容纳声明的载荷")
+        return bits
+    
+    def extract_payload(self, watermarked_image, channels=None):
+        """提取 embed_payload 写入的字节载荷，找不到或校验失败时抛出 ValueError"""
+        header_bytes = PAYLOAD_HEADER.size
+        header_bits = self._read_bits(watermarked_image, 0, PAYLOAD_HEADER_BITS, channels)
+        votes = header_bits.reshape(PAYLOAD_HEADER_COPIES, -1).sum(axis=0)
+        header = np.packbits(votes * 2 > PAYLOAD_HEADER_COPIES).tobytes()[:header_bytes]
+        
+        magic, repeat, length, crc = PAYLOAD_HEADER.unpack(header)
+        if magic != PAYLOAD_MAGIC or repeat == 0:
+            raise ValueError("未找到有效的水印载荷")
+        
+        # 先只读取第一份载荷
+        payload_bits = length * 8
+        bits = self._read_bits(watermarked_image, PAYLOAD_HEADER_BITS, payload_bits, channels)
+        payload = np.packbits(bits).tobytes()
+        if zlib.crc32(payload) == crc:
+            return payload
+        
+        if repeat > 1:
+            # 读取全部副本，按位多数表决
+            bits = self._read_bits(watermarked_image, PAYLOAD_HEADER_BITS, payload_bits * repeat, channels)
+            votes = bits.reshape(repeat, payload_bits).sum(axis=0, dtype=np.uint16)
+            payload = np.packbits(votes * 2 > repeat).tobytes()
+            if zlib.crc32(payload) == crc:
+                return payload
+        raise ValueError("水印载荷CRC校验失败")
+    
+    # ------------------------------------------------------------------
+    # 批量接口：对同尺寸的一批图像做一次向量化的位运算
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _stack(images):
+        # 接受 (N, H, W) 的uint8数组，或由同尺寸PIL图像/二维数组组成的列表
+        if isinstance(images, np.ndarray):
+            if images.ndim != 3 or images.dtype != np.uint8:
+                raise ValueError("批量输入必须是 (N, H, W) 的uint8数组")
+            return images
+        arrays = [np.asarray(image) for image in images]
+        if not arrays:
+            raise ValueError("批量输入不能为空")
+        shape = arrays[0].shape
+        if len(shape) != 2 or any(array.shape != shape for array in arrays):
+            raise ValueError("批量输入中的图像必须是尺寸相同的灰度图像")
+        return np.stack(arrays).astype(np.uint8, copy=False)
+    
+    def _watermark_plane(self, watermark, shape):
+        # 将水印调整为目标尺寸并二值化为0/1平面
+        def build():
+            resized = watermark.resize((shape[1], shape[0]), Image.Resampling.LANCZOS)
+            return (np.array(resized) > 128).astype(np.uint8)
+        return self.plane_cache.get(watermark, shape, 'LSB', None, build)
+    
+    def embed_batch(self, host_images, watermark, out=None):
+        """
+        批量嵌入水印，返回 (N, H, W) 的uint8数组。
+        out 为可选的输出缓冲区，可以直接传入 host_images 本身实现原地修改。
+        """
+        with stage("lsb.embed_batch.load"):
+            hosts = self._stack(host_images)
+        with stage("lsb.embed_batch.resize"):
+            plane = self._watermark_plane(watermark, hosts.shape[1:])
+        
+        if out is None:
+            out = np.empty_like(hosts)
+        elif out.shape != hosts.shape or out.dtype != np.uint8:
+            raise ValueError("输出缓冲区的尺寸和类型必须与输入一致")
+        
+        # 清除最低位后写入水印位，整个批次一次完成
+        with stage("lsb.embed_batch.bitops"):
+            np.bitwise_and(hosts, 0xFE, out=out)
+            np.bitwise_or(out, plane, out=out)
+        return out
+    
+    def extract_batch(self, watermarked_images, watermark_size, out=None):
+        """
+        批量提取水印，返回 (N, h, w) 的uint8数组，(w, h) 为 watermark_size。
+        out 为可选的输出缓冲区。
+        """
+        with stage("lsb.extract_batch.load"):
+            images = self._stack(watermarked_images)
+        
+        # 一次性取出所有图像的最低位平面
+        with stage("lsb.extract_batch.bitops"):
+            planes = np.bitwise_and(images, 0x01)
+            planes *= 255
+        
+        width, height = watermark_size
+        if out is None:
+            out = np.empty((images.shape[0], height, width), dtype=np.uint8)
+        elif out.shape != (images.shape[0], height, width) or out.dtype != np.uint8:
+            raise ValueError("输出缓冲区的尺寸和类型必须为 (N, h, w) 的uint8")
         
-        return extracted_image 
\ No newline at end of file
+        with stage("lsb.extract_batch.resize"):
+            for i, plane in enumerate(planes):
+                out[i] = Image.fromarray(plane).resize(watermark_size, Image.Resampling.LANCZOS)
+        return out
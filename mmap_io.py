@@ -0,0 +1,313 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+# 内存映射的图像读写
+#
+# 对未压缩的TIFF、原始像素文件(.raw)和 .npy 文件，直接把像素数据映射为
+# numpy 视图，不经过PIL解码，也不复制整幅图像。配合
+# LSBWatermark.embed_inplace 和 DWTWatermark.embed_tiled(out=...)，
+# 可以在额外内存接近于零的情况下为数GB的图像嵌入水印。
+#
+# TIFF只支持最常见的布局：第一个IFD、无压缩、8位无符号、灰度(BlackIsZero)
+# 或交错存放的RGB/RGBA，且各条带在文件中连续。其他TIFF请先用PIL转换。
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+RAW_EXTENSIONS = ('.raw', '.bin', '.gray')
+
+# TIFF标签
+_IMAGE_WIDTH = 256
+_IMAGE_LENGTH = 257
+_BITS_PER_SAMPLE = 258
+_COMPRESSION = 259
+_PHOTOMETRIC = 262
+_STRIP_OFFSETS = 273
+_SAMPLES_PER_PIXEL = 277
+_ROWS_PER_STRIP = 278
+_STRIP_BYTE_COUNTS = 279
+_PLANAR_CONFIG = 284
+_TILE_WIDTH = 322
+_EXTRA_SAMPLES = 338
+_SAMPLE_FORMAT = 339
+
+# TIFF数据类型 -> (struct格式, 字节数)
+_TIFF_TYPES = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+
+# 经典TIFF单个条带最大只能寻址4GB，超过时改写BigTIFF
+_CLASSIC_LIMIT = 2 ** 32 - 4096
+
+
+def _read_ifd(f):
+    """读取第一个IFD，返回 {标签: 值元组}"""
+    f.seek(0)
+    head = f.read(16)
+    if head[:2] == b'II':
+        order = '<'
+    elif head[:2] == b'MM':
+        order = '>'
+    else:
+        raise ValueError("不是TIFF文件")
+    version, = struct.unpack(order + 'H', head[2:4])
+    if version == 42:
+        ifd_offset, = struct.unpack(order + 'I', head[4:8])
+        count_fmt, pointer_fmt = 'H', 'I'
+    elif version == 43:
+        # BigTIFF：计数和偏移都是8字节
+        ifd_offset, = struct.unpack(order + 'Q', head[8:16])
+        count_fmt, pointer_fmt = 'Q', 'Q'
+    else:
+        raise ValueError(f"不支持的TIFF版本: {version}")
+
+    entry = struct.Struct(order + 'HH' + pointer_fmt)
+    inline = struct.calcsize(pointer_fmt)
+    f.seek(ifd_offset)
+    num_entries, = struct.unpack(order + count_fmt, f.read(struct.calcsize(count_fmt)))
+    raw = f.read(num_entries * (entry.size + inline))
+
+    tags = {}
+    for i in range(num_entries):
+        start = i * (entry.size + inline)
+        tag, type_, count = entry.unpack_from(raw, start)
+        if type_ not in _TIFF_TYPES:
+            continue
+        fmt, size = _TIFF_TYPES[type_]
+        data = raw[start + entry.size:start + entry.size + inline]
+        if count * size > inline:
+            # 值放不进条目时，条目中保存的是值所在的文件偏移
+            f.seek(struct.unpack(order + pointer_fmt, data)[0])
+            data = f.read(count * size)
+        tags[tag] = struct.unpack(order + fmt * count, data[:count * size])
+    return tags
+
+
+def tiff_layout(path):
+    """
+    解析未压缩TIFF的像素布局，返回 (数据偏移, 形状)。
+    形状为 (高, 宽) 或 (高, 宽, 通道数)；不满足内存映射条件时抛出 ValueError。
+    """
+    with open(path, 'rb') as f:
+        tags = _read_ifd(f)
+
+    def tag(code, default=None):
+        value = tags.get(code)
+        if value is None:
+            if default is None:
+                raise ValueError(f"TIFF缺少必需的标签 {code}")
+            return default
+        return value
+
+    if _TILE_WIDTH in tags:
+        raise ValueError("不支持分块(tiled)存储的TIFF")
+    if tag(_COMPRESSION, (1,))[0] != 1:
+        raise ValueError("只能内存映射未压缩的TIFF")
+    samples = tag(_SAMPLES_PER_PIXEL, (1,))[0]
+    if set(tag(_BITS_PER_SAMPLE, (1,))) != {8}:
+        raise ValueError("只支持每通道8位的TIFF")
+    if set(tag(_SAMPLE_FORMAT, (1,))) != {1}:
+        raise ValueError("只支持无符号整数像素的TIFF")
+    if samples > 1 and tag(_PLANAR_CONFIG, (1,))[0] != 1:
+        raise ValueError("只支持通道交错存放(PlanarConfiguration=1)的TIFF")
+    photometric = tag(_PHOTOMETRIC)[0]
+    if (samples, photometric) not in ((1, 1), (3, 2), (4, 2)):
+        raise ValueError(f"不支持的TIFF颜色类型: Photometric={photometric}, 通道数={samples}")
+
+    width = tag(_IMAGE_WIDTH)[0]
+    height = tag(_IMAGE_LENGTH)[0]
+    offsets = tag(_STRIP_OFFSETS)
+    counts = tag(_STRIP_BYTE_COUNTS)
+    # 各条带必须首尾相接，整幅图像才能映射为一个连续数组
+    for offset, count, next_offset in zip(offsets, counts, offsets[1:]):
+        if offset + count != next_offset:
+            raise ValueError("TIFF的条带在文件中不连续，无法内存映射")
+    expected = width * height * samples
+    if sum(counts) < expected:
+        raise ValueError("TIFF像素数据长度与图像尺寸不符")
+
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    return offsets[0], shape
+
+
+def open_tiff(path, mode='r'):
+    """将未压缩TIFF的像素数据映射为 (H, W) 或 (H, W, C) 的uint8数组"""
+    offset, shape = tiff_layout(path)
+    return np.memmap(path, dtype=np.uint8, mode=mode, offset=offset, shape=shape)
+
+
+def create_tiff(path, shape):
+    """
+    新建未压缩TIFF(单条带)，返回可写的内存映射数组，像素初始为0。
+    shape 为 (高, 宽) 或 (高, 宽, 3/4)；数据超过4GB时写为BigTIFF。
+    """
+    height, width = shape[:2]
+    samples = shape[2] if len(shape) == 3 else 1
+    if samples not in (1, 3, 4):
+        raise ValueError(f"不支持的通道数: {samples}")
+    nbytes = height * width * samples
+    big = nbytes >= _CLASSIC_LIMIT
+
+    if big:
+        header_fmt, count_fmt, entry_fmt, inline, pointer_fmt = '<2sHHHQ', 'Q', '<HHQ', 8, 'Q'
+    else:
+        header_fmt, count_fmt, entry_fmt, inline, pointer_fmt = '<2sHI', 'H', '<HHI', 4, 'I'
+    long_type = 16 if big else 4
+
+    entries = [
+        (_IMAGE_WIDTH, long_type, [width]),
+        (_IMAGE_LENGTH, long_type, [height]),
+        (_BITS_PER_SAMPLE, 3, [8] * samples),
+        (_COMPRESSION, 3, [1]),
+        (_PHOTOMETRIC, 3, [1 if samples == 1 else 2]),
+        (_STRIP_OFFSETS, long_type, [0]),  # 数据偏移在布局确定后回填
+        (_SAMPLES_PER_PIXEL, 3, [samples]),
+        (_ROWS_PER_STRIP, long_type, [height]),
+        (_STRIP_BYTE_COUNTS, long_type, [nbytes]),
+        (_PLANAR_CONFIG, 3, [1]),
+    ]
+    if samples == 4:
+        entries.append((_EXTRA_SAMPLES, 3, [2]))  # 非预乘alpha
+
+    header_size = struct.calcsize(header_fmt)
+    entry_size = struct.calcsize(entry_fmt) + inline
+    ifd_size = struct.calcsize('<' + count_fmt) + len(entries) * entry_size + struct.calcsize('<' + pointer_fmt)
+    extra_offset = header_size + ifd_size
+
+    # 放不进条目的值(如RGB的BitsPerSample)写在IFD之后
+    extra = b''
+    packed_entries = []
+    for tag, type_, values in entries:
+        fmt, size = _TIFF_TYPES[type_]
+        packed_entries.append((tag, type_, values, fmt, size))
+        if len(values) * size > inline:
+            extra += struct.pack('<' + fmt * len(values), *values)
+    # 像素数据按16字节对齐
+    data_offset = -(-(extra_offset + len(extra)) // 16) * 16
+
+    with open(path, 'wb') as f:
+        if big:
+            f.write(struct.pack(header_fmt, b'II', 43, 8, 0, header_size))
+        else:
+            f.write(struct.pack(header_fmt, b'II', 42, header_size))
+        f.write(struct.pack('<' + count_fmt, len(entries)))
+        pointer = extra_offset
+        for tag, type_, values, fmt, size in packed_entries:
+            if tag == _STRIP_OFFSETS:
+                values = [data_offset]
+            f.write(struct.pack(entry_fmt, tag, type_, len(values)))
+            if len(values) * size > inline:
+                f.write(struct.pack('<' + pointer_fmt, pointer))
+                pointer += len(values) * size
+            else:
+                f.write(struct.pack('<' + fmt * len(values), *values).ljust(inline, b'\0'))
+        f.write(struct.pack('<' + pointer_fmt, 0))  # 没有下一个IFD
+        f.write(extra)
+        # 以稀疏文件的方式分配像素区
+        f.truncate(data_offset + nbytes)
+
+    return np.memmap(path, dtype=np.uint8, mode='r+', offset=data_offset, shape=tuple(shape))
+
+
+def open_raw(path, shape, offset=0, mode='r'):
+    """将无文件头的原始uint8像素文件映射为给定形状的数组"""
+    expected = offset + int(np.prod(shape))
+    if os.path.getsize(path) < expected:
+        raise ValueError(f"原始像素文件 {path} 的长度不足以容纳形状 {tuple(shape)}")
+    return np.memmap(path, dtype=np.uint8, mode=mode, offset=offset, shape=tuple(shape))
+
+
+def create_raw(path, shape):
+    with open(path, 'wb') as f:
+        f.truncate(int(np.prod(shape)))
+    return np.memmap(path, dtype=np.uint8, mode='r+', shape=tuple(shape))
+
+
+def open_image(path, mode='r', shape=None, offset=0):
+    """
+    按扩展名内存映射图像文件：TIFF、.npy，或需要给出 shape 的原始像素文件。
+    mode 与 np.memmap 相同('r' 只读，'r+' 可写，'c' 写时复制)。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TIFF_EXTENSIONS:
+        return open_tiff(path, mode)
+    if ext == '.npy':
+        array = np.load(path, mmap_mode=mode)
+        if array.dtype != np.uint8 or array.ndim not in (2, 3):
+            raise ValueError(".npy 图像必须是二维或三维的uint8数组")
+        return array
+    if ext in RAW_EXTENSIONS:
+        if shape is None:
+            raise ValueError("原始像素文件需要指定形状")
+        return open_raw(path, shape, offset, mode)
+    raise ValueError(f"不支持内存映射的图像格式: {ext or path}")
+
+
+def create_image(path, shape):
+    """按扩展名新建可写的内存映射输出文件"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TIFF_EXTENSIONS:
+        return create_tiff(path, shape)
+    if ext == '.npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=tuple(shape))
+    if ext in RAW_EXTENSIONS:
+        return create_raw(path, shape)
+    raise ValueError(f"不支持内存映射的图像格式: {ext or path}")
+
+
+def release_pages(array):
+    """
+    把内存映射数组已访问的页交还给系统：可写映射先写回文件再丢弃，
+    之后访问时从页缓存重新读入，使处理超大文件时的常驻内存保持在一段
+    数据的大小。非内存映射数组和写时复制('c')映射不做任何处理。
+    """
+    if not isinstance(array, np.memmap) or array.mode == 'c' or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    base = array
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    if base is None:
+        return
+    if array.mode != 'r':
+        base.flush()
+    base.madvise(mmap.MADV_DONTNEED)
+
+
+def main(argv=None):
+    from PIL import Image
+
+    from algorithms import get_algorithm
+
+    parser = argparse.ArgumentParser(description="以内存映射方式为超大TIFF/原始像素图像嵌入水印")
+    parser.add_argument("input", help="载体图像(未压缩TIFF、.npy 或原始像素文件)")
+    parser.add_argument("-w", "--watermark", required=True, help="水印图像路径")
+    parser.add_argument("-o", "--output", help="输出文件，省略时直接修改输入文件(仅LSB)")
+    parser.add_argument("-a", "--algorithm", default="LSB", choices=["LSB", "DWT"],
+                        type=str.upper, help="水印算法")
+    parser.add_argument("--shape", type=int, nargs='+', metavar="N",
+                        help="原始像素文件的形状：高 宽 [通道数]")
+    parser.add_argument("--offset", type=int, default=0, help="原始像素文件的数据偏移")
+    args = parser.parse_args(argv)
+
+    watermark = Image.open(args.watermark).convert('L')
+    in_place = args.output is None
+    if in_place and args.algorithm != "LSB":
+        parser.error("只有LSB算法支持原地修改，请用 -o 指定输出文件")
+
+    host = open_image(args.input, 'r+' if in_place else 'r', args.shape, args.offset)
+    out = host if in_place else create_image(args.output, host.shape)
+
+    if args.algorithm == "LSB":
+        get_algorithm("LSB").embed_inplace(host, watermark, out=out)
+    else:
+        if host.ndim != 2:
+            parser.error("DWT分块模式只支持灰度图像")
+        get_algorithm("DWT").embed_tiled(host, watermark, out=out)
+    out.flush()
+    print(f"完成: {args.input} -> {args.output or args.input} ({host.shape[1]}x{host.shape[0]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
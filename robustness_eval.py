@@ -0,0 +1,329 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# 默认攻击网格：(攻击类型, 参数)
+DEFAULT_ATTACKS = [
+    ('none', 0),
+    ('jpeg', 90), ('jpeg', 70), ('jpeg', 50),
+    ('resize', 0.75), ('resize', 0.5),
+    ('crop', 0.1), ('crop', 0.25),
+    ('noise', 2.0), ('noise', 5.0),
+    ('blur', 0.5), ('blur', 1.0),
+    ('rotate', 1.0), ('rotate', 5.0),
+]
+
+FIELDS = ['host', 'algorithm', 'alpha', 'attack', 'param', 'psnr', 'ssim',
+          'correlation', 'bit_accuracy', 'detected', 'seconds', 'error']
+
+
+# ----------------------------------------------------------------------
+# 攻击：输入输出均为同尺寸的灰度PIL图像，以便按原有几何位置提取水印
+# ----------------------------------------------------------------------
+def attack_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=int(quality))
+    buffer.seek(0)
+    return Image.open(buffer).convert('L')
+
+
+def attack_resize(image, scale):
+    # 缩小后再放大回原尺寸
+    width, height = image.size
+    small = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.BILINEAR)
+    return small.resize((width, height), Image.Resampling.BILINEAR)
+
+
+def attack_crop(image, fraction):
+    # 裁掉四周 fraction 比例的边框并以黑色填充，保持几何位置不变
+    array = np.array(image)
+    dy, dx = int(array.shape[0] * fraction / 2), int(array.shape[1] * fraction / 2)
+    cropped = np.zeros_like(array)
+    cropped[dy:array.shape[0] - dy, dx:array.shape[1] - dx] = array[dy:array.shape[0] - dy, dx:array.shape[1] - dx]
+    return Image.fromarray(cropped)
+
+
+def attack_noise(image, sigma, seed=0):
+    rng = np.random.default_rng(seed)
+    noisy = np.asarray(image, dtype=np.float32) + rng.normal(0, sigma, (image.size[1], image.size[0]))
+    return Image.fromarray(np.clip(np.rint(noisy), 0, 255).astype(np.uint8))
+
+
+def attack_blur(image, radius):
+    return image.filter(ImageFilter.GaussianBlur(radius))
+
+
+def attack_rotate(image, degrees):
+    return image.rotate(degrees, resample=Image.Resampling.BILINEAR, expand=False)
+
+
+ATTACKS = {
+    'none': lambda image, _: image,
+    'jpeg': attack_jpeg,
+    'resize': attack_resize,
+    'crop': attack_crop,
+    'noise': attack_noise,
+    'blur': attack_blur,
+    'rotate': attack_rotate,
+}
+
+
+# ----------------------------------------------------------------------
+# 不可感知性指标
+# ----------------------------------------------------------------------
+def psnr(reference, test):
+    mse = np.mean((np.asarray(reference, dtype=np.float64) - np.asarray(test, dtype=np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def _box_mean(array, size):
+    # 利用积分图计算 size x size 窗口内的均值(只保留完整窗口)
+    integral = np.pad(array, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    total = integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+    return total / (size * size)
+
+
+def ssim(reference, test, window=7):
+    """窗口为 window x window 均值滤波的SSIM，取所有窗口的平均值"""
+    x = np.asarray(reference, dtype=np.float64)
+    y = np.asarray(test, dtype=np.float64)
+    if min(x.shape) < window:
+        window = min(x.shape)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_x, mu_y = _box_mean(x, window), _box_mean(y, window)
+    # 使用无偏估计，与常见实现保持一致
+    correction = window * window / (window * window - 1)
+    var_x = (_box_mean(x * x, window) - mu_x * mu_x) * correction
+    var_y = (_box_mean(y * y, window) - mu_y * mu_y) * correction
+    cov = (_box_mean(x * y, window) - mu_x * mu_y) * correction
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / \
+        ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+# ----------------------------------------------------------------------
+# 单个任务：一张载体 x 一种算法/强度，依次执行全部攻击
+# ----------------------------------------------------------------------
+def _load_host(spec):
+    if isinstance(spec, int):
+        from benchmark import synthetic_host
+        return f"synthetic-{spec}", synthetic_host(512, seed=spec)
+    with Image.open(spec) as image:
+        return spec, image.convert('L')
+
+
+def _score(detector, candidates, watermark_bits, extracted):
+    correlation = float(detector.score(extracted, candidates)[0, 0])
+    extracted_bits = np.asarray(extracted.resize(candidates.size)) > 128
+    bit_accuracy = float(np.mean(extracted_bits == watermark_bits))
+    return correlation, bit_accuracy, correlation > detector.threshold
+
+
+def evaluate_host(host_spec, watermark, algorithm, alpha, attacks):
+    """对一张载体执行完整的攻击网格，返回结果行列表"""
+    from algorithms import get_algorithm
+    from watermark_detector import WatermarkDetector
+
+    name, host = _load_host(host_spec)
+    detector = WatermarkDetector()
+    candidates = detector.prepare_candidates([watermark])
+    watermark_bits = np.asarray(watermark) > 128
+    watermark_size = watermark.size
+
+    lsb = get_algorithm("LSB")
+    dwt = get_algorithm("DWT")
+    if alpha is not None:
+        dwt.alpha = alpha
+
+    if algorithm == "LSB":
+        watermarked = lsb.embed(host, watermark)
+    elif algorithm == "DWT":
+        watermarked = dwt.embed(host, watermark)
+    elif algorithm == "DWT_BLIND":
+        watermarked = dwt.embed_blind(host, watermark)
+    else:
+        raise ValueError(f"未知的水印算法: {algorithm}")
+    # DWT整图嵌入在奇数尺寸时会补齐一行/一列，统一裁回载体尺寸
+    watermarked = watermarked.crop((0, 0) + host.size)
+
+    quality = {'psnr': psnr(host, watermarked), 'ssim': ssim(host, watermarked)}
+
+    rows = []
+    for attack, param in attacks:
+        row = {'host': name, 'algorithm': algorithm, 'alpha': alpha, 'attack': attack, 'param': param}
+        row.update(quality)
+        start = time.perf_counter()
+        try:
+            attacked = ATTACKS[attack](watermarked, param)
+            if algorithm == "LSB":
+                extracted = lsb.extract(attacked, watermark_size)
+            elif algorithm == "DWT":
+                extracted = dwt.extract(attacked, host, watermark_size)
+            else:
+                extracted = dwt.extract_blind(attacked, watermark_size)
+            correlation, bit_accuracy, detected = _score(detector, candidates, watermark_bits, extracted)
+            if algorithm == "DWT_BLIND":
+                # 盲检测模式以小波域相关检测的判定为准
+                detected, _ = dwt.detect_blind(attacked, watermark)
+            row.update(correlation=correlation, bit_accuracy=bit_accuracy, detected=bool(detected), error='')
+        except Exception as e:
+            row.update(correlation=None, bit_accuracy=None, detected=False,
+                       error=f"{type(e).__name__}: {e}")
+        row['seconds'] = time.perf_counter() - start
+        rows.append(row)
+    return rows
+
+
+def _evaluate_task(args):
+    host_spec, watermark_bytes, watermark_size, algorithm, alpha, attacks = args
+    watermark = Image.frombytes('L', watermark_size, watermark_bytes)
+    try:
+        return evaluate_host(host_spec, watermark, algorithm, alpha, attacks)
+    except Exception as e:
+        return [{'host': str(host_spec), 'algorithm': algorithm, 'alpha': alpha, 'attack': '', 'param': '',
+                 'detected': False, 'error': f"{type(e).__name__}: {e}"}]
+
+
+class ResultWriter:
+    """将结果逐行写入CSV和/或JSON Lines文件"""
+
+    def __init__(self, csv_path=None, json_path=None):
+        self._csv_file = open(csv_path, 'w', newline='', encoding='utf-8') if csv_path else None
+        self._csv = csv.DictWriter(self._csv_file, fieldnames=FIELDS) if self._csv_file else None
+        if self._csv:
+            self._csv.writeheader()
+        self._json_file = open(json_path, 'w', encoding='utf-8') if json_path else None
+
+    def write(self, row):
+        if self._csv:
+            self._csv.writerow({field: row.get(field, '') for field in FIELDS})
+            self._csv_file.flush()
+        if self._json_file:
+            self._json_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+            self._json_file.flush()
+
+    def close(self):
+        for f in (self._csv_file, self._json_file):
+            if f:
+                f.close()
+
+
+def run_evaluation(hosts, watermark, algorithms=("LSB", "DWT", "DWT_BLIND"), alphas=(None,),
+                   attacks=DEFAULT_ATTACKS, workers=None, on_row=None):
+    """
+    对载体集合运行攻击网格，返回全部结果行。
+    hosts 为图像路径列表，或整数(表示使用对应种子的合成载体)；
+    alphas 只作用于DWT算法，None表示使用默认强度。
+    """
+    watermark = watermark.convert('L')
+    tasks = []
+    for host in hosts:
+        for algorithm in algorithms:
+            for alpha in (alphas if algorithm == "DWT" else (None,)):
+                tasks.append((host, watermark.tobytes(), watermark.size, algorithm, alpha, list(attacks)))
+
+    rows = []
+
+    def collect(task_rows):
+        for row in task_rows:
+            rows.append(row)
+            if on_row is not None:
+                on_row(row)
+
+    if workers == 1:
+        for task in tasks:
+            collect(_evaluate_task(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(_evaluate_task, task) for task in tasks]):
+                collect(future.result())
+    return rows
+
+
+def summarize(rows):
+    """按 (算法, 强度, 攻击, 参数) 汇总平均相关系数和检出率"""
+    groups = defaultdict(list)
+    for row in rows:
+        if row.get('error'):
+            continue
+        groups[(row['algorithm'], row['alpha'], row['attack'], row['param'])].append(row)
+    summary = []
+    for (algorithm, alpha, attack, param), items in sorted(groups.items(), key=lambda item: str(item[0])):
+        summary.append({
+            'algorithm': algorithm, 'alpha': alpha, 'attack': attack, 'param': param,
+            'count': len(items),
+            'psnr': float(np.mean([r['psnr'] for r in items])),
+            'ssim': float(np.mean([r['ssim'] for r in items])),
+            'correlation': float(np.mean([r['correlation'] for r in items])),
+            'bit_accuracy': float(np.mean([r['bit_accuracy'] for r in items])),
+            'detection_rate': float(np.mean([r['detected'] for r in items])),
+        })
+    return summary
+
+
+def _parse_attack(text):
+    attack, _, param = text.partition(':')
+    if attack not in ATTACKS:
+        raise argparse.ArgumentTypeError(f"未知的攻击类型: {attack}")
+    return attack, float(param) if param else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="水印鲁棒性评估")
+    parser.add_argument("inputs", nargs="*", help="载体图像目录、通配符或清单文件")
+    parser.add_argument("--synthetic", type=int, default=0, help="使用指定数量的合成载体")
+    parser.add_argument("-w", "--watermark", default=None, help="水印图像路径")
+    parser.add_argument("--text", default="WATERMARK", help="未指定水印图像时生成的文本水印")
+    parser.add_argument("-a", "--algorithms", nargs="+", type=str.upper,
+                        choices=["LSB", "DWT", "DWT_BLIND"], default=["LSB", "DWT", "DWT_BLIND"])
+    parser.add_argument("--alphas", type=float, nargs="+", default=None, help="DWT算法的强度因子")
+    parser.add_argument("--attacks", type=_parse_attack, nargs="+", default=None,
+                        help="攻击列表，如 jpeg:70 resize:0.5 noise:5")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数")
+    parser.add_argument("--csv", default=None, help="结果CSV文件路径")
+    parser.add_argument("--json", default=None, help="结果JSON Lines文件路径")
+    args = parser.parse_args(argv)
+
+    hosts = []
+    if args.inputs:
+        from batch_embed import collect_inputs
+        hosts.extend(collect_inputs(args.inputs))
+    hosts.extend(range(args.synthetic))
+    if not hosts:
+        parser.error("请指定载体图像或使用 --synthetic")
+
+    if args.watermark:
+        watermark = Image.open(args.watermark).convert('L')
+    else:
+        from watermark_generator import WatermarkGenerator
+        watermark = Image.fromarray(WatermarkGenerator().generate_text_watermark(args.text))
+
+    writer = ResultWriter(args.csv, args.json)
+    start = time.perf_counter()
+    try:
+        rows = run_evaluation(hosts, watermark, args.algorithms, args.alphas or (None,),
+                              args.attacks or DEFAULT_ATTACKS, args.workers, on_row=writer.write)
+    finally:
+        writer.close()
+
+    print(f"{'算法':<10} {'强度':>6} {'攻击':<8} {'参数':>6} {'PSNR':>7} {'SSIM':>6} {'相关系数':>8} {'位准确率':>8} {'检出率':>6}")
+    for item in summarize(rows):
+        alpha = '' if item['alpha'] is None else f"{item['alpha']:g}"
+        print(f"{item['algorithm']:<10} {alpha:>6} {item['attack']:<8} {item['param']:>6} "
+              f"{item['psnr']:7.2f} {item['ssim']:6.3f} {item['correlation']:8.3f} "
+              f"{item['bit_accuracy']:8.3f} {item['detection_rate']:6.2f}")
+    errors = sum(1 for row in rows if row.get('error'))
+    print(f"共 {len(rows)} 条结果，失败 {errors} 条，耗时 {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
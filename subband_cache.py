@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+import numpy as np
+
+from lru_cache import LRUCache
+
+
+class SubbandCache(LRUCache):
+    """
+    原始图像小波子带的LRU缓存。
+
+    以图像内容哈希为键，缓存 DWTWatermark.extract 所需的原始图像子带，
+    同一原始图像对应多份待检图像时只需做一次小波分解。
+    指定 cache_dir 后，子带会以 .npy 文件持久化到磁盘，进程重启后
+    通过内存映射(mmap_mode='r')直接读取，不会重复计算。
+    """
+
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024, cache_dir=None, mmap=True):
+        super().__init__(max_entries, max_bytes)
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(array, tag=""):
+        # 形状和类型也参与哈希，避免内容相同但尺寸不同的图像冲突
+        array = np.ascontiguousarray(array)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{tag}|{array.dtype.str}|{array.shape}".encode())
+        digest.update(memoryview(array).cast('B'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r' if self.mmap else None)
+
+    def _save(self, key, stacked):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, stacked)
+        # 原子替换，避免并发进程读到写了一半的文件
+        os.replace(tmp_path, path)
+
+    def get_or_compute(self, array, compute, tag=""):
+        """
+        返回 array 对应的子带。compute(array) 应返回若干同形状的子带，
+        结果按 (N, h, w) 堆叠后缓存；返回值为子带元组。
+        """
+        key = self.key_for(array, tag)
+        cached = self._lookup(key)
+        if cached is not None:
+            return tuple(cached)
+
+        stacked = self._load(key)
+        if stacked is None:
+            with self._lock:
+                self.misses += 1
+            stacked = np.stack(compute(array))
+            if self.cache_dir:
+                self._save(key, stacked)
+                if self.mmap:
+                    stacked = self._load(key)
+        else:
+            with self._lock:
+                self.hits += 1
+
+        # 内存映射的数组不计入内存占用
+        self._store(key, stacked, 0 if isinstance(stacked, np.memmap) else stacked.nbytes)
+        return tuple(stacked)
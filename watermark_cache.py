@@ -0,0 +1,57 @@
+import hashlib
+
+import numpy as np
+from PIL import Image
+
+from lru_cache import LRUCache
+
+
+def watermark_key(watermark):
+    """根据水印内容计算标识，内容相同的水印共享缓存"""
+    if isinstance(watermark, Image.Image):
+        header = f"{watermark.mode}|{watermark.size}"
+        data = watermark.tobytes()
+    else:
+        array = np.ascontiguousarray(watermark)
+        header = f"{array.dtype.str}|{array.shape}"
+        data = memoryview(array).cast('B')
+    digest = hashlib.blake2b(header.encode(), digest_size=16)
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class WatermarkPlaneCache(LRUCache):
+    """
+    预处理后水印数组的LRU缓存。
+
+    LSB和DWT在嵌入前都要把水印缩放到目标尺寸并做二值化/归一化，
+    而载体图像通常只有少数几种分辨率。本缓存以
+    (水印标识, 目标尺寸, 算法, 参数) 为键保存预处理结果，
+    按条目数和字节数淘汰最久未使用的条目。缓存的数组为只读。
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024):
+        super().__init__(max_entries, max_bytes)
+
+    def get(self, watermark, shape, algorithm, param, build):
+        """
+        返回缓存的预处理结果，未命中时调用 build() 计算并缓存。
+        watermark 可以是水印图像，也可以是事先算好的水印标识字符串。
+        """
+        wm_id = watermark if isinstance(watermark, str) else watermark_key(watermark)
+        key = (wm_id, tuple(shape), algorithm, param)
+        array = self._lookup(key)
+        if array is not None:
+            return array
+        with self._lock:
+            self.misses += 1
+
+        array = build()
+        array.setflags(write=False)
+        # 超过容量上限的单个结果不缓存，直接返回
+        self._store(key, array, array.nbytes)
+        return array
+
+
+# 进程内共享的默认缓存，LSBWatermark 和 DWTWatermark 未指定缓存时使用
+default_plane_cache = WatermarkPlaneCache()
@@ -1,20 +1,117 @@
 import numpy as np
 from PIL import Image
-from scipy.stats import pearsonr
+
+from instrumentation import stage
 
 class WatermarkDetector:
     def __init__(self):
         self.threshold = 0.7  # 相关系数阈值
         
     def detect(self, original_watermark, extracted_watermark):
+        # 只有单对比较时才需要scipy，批量打分路径不依赖它
+        from scipy.stats import pearsonr
+        
         # 转换为numpy数组
-        original_array = np.array(original_watermark).flatten()
-        extracted_array = np.array(extracted_watermark).flatten()
+        with stage("detector.detect.load"):
+            original_array = np.array(original_watermark).flatten()
+            extracted_array = np.array(extracted_watermark).flatten()
         
         # 计算相关系数
-        correlation, _ = pearsonr(original_array, extracted_array)
+        with stage("detector.detect.pearsonr"):
+            correlation, _ = pearsonr(original_array, extracted_array)
         
         # 判断是否检测到水印
         is_detected = correlation > self.threshold
         
-        return is_detected, correlation 
\ No newline at end of file
+        return is_detected, correlation
+    
+    def prepare_candidates(self, watermarks, ids=None, size=None):
+        """
+        预处理候选水印库：统一尺寸、去均值并归一化后堆叠为矩阵，只需做一次。
+        ids 为各水印的标识，默认使用序号；size 为 (宽, 高)，默认取第一个水印的尺寸。
+        """
+        watermarks = list(watermarks)
+        if not watermarks:
+            raise ValueError("候选水印不能为空")
+        if size is None:
+            first = watermarks[0]
+            size = first.size if isinstance(first, Image.Image) else (first.shape[1], first.shape[0])
+        if ids is None:
+            ids = list(range(len(watermarks)))
+        elif len(ids) != len(watermarks):
+            raise ValueError("ids 的数量与候选水印数量不一致")
+        with stage("detector.prepare.normalize"):
+            return CandidateBank(normalize_watermarks(watermarks, size), ids, size)
+    
+    def score(self, extracted_watermarks, candidates):
+        """
+        计算提取水印与全部候选水印的相关系数，返回 (M, K) 的矩阵。
+        extracted_watermarks 可以是单个水印或水印列表，通过一次矩阵乘法完成。
+        """
+        with stage("detector.score.normalize"):
+            queries = normalize_watermarks(_as_list(extracted_watermarks), candidates.size)
+        with stage("detector.score.matmul"):
+            return queries @ candidates.matrix.T
+    
+    def match(self, extracted_watermarks, candidates, top_k=5):
+        """
+        返回每个提取水印得分最高的 top_k 个候选：
+        [[(id, 相关系数, 是否检测到), ...], ...]，按相关系数从高到低排列。
+        传入单个水印时只返回其对应的列表。
+        """
+        single = not isinstance(extracted_watermarks, (list, tuple)) and \
+            not (isinstance(extracted_watermarks, np.ndarray) and extracted_watermarks.ndim == 3)
+        scores = self.score(extracted_watermarks, candidates)
+        
+        k = min(top_k, scores.shape[1])
+        if k <= 0:
+            return [] if single else [[] for _ in range(scores.shape[0])]
+        # 先用 argpartition 取出前k个，再只对这k个排序
+        with stage("detector.match.topk"):
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for row, indices in zip(scores, top):
+                indices = indices[np.argsort(-row[indices])]
+                results.append([(candidates.ids[i], float(row[i]), bool(row[i] > self.threshold))
+                                for i in indices])
+        return results[0] if single else results
+
+
+class CandidateBank:
+    """预处理后的候选水印矩阵 (K, 宽*高)，每行均值为0、范数为1"""
+
+    def __init__(self, matrix, ids, size):
+        self.matrix = matrix
+        self.ids = list(ids)
+        self.size = tuple(size)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _as_list(watermarks):
+    if isinstance(watermarks, np.ndarray):
+        return list(watermarks) if watermarks.ndim == 3 else [watermarks]
+    if isinstance(watermarks, (list, tuple)):
+        return list(watermarks)
+    return [watermarks]
+
+
+def normalize_watermarks(watermarks, size):
+    """将水印统一到 size=(宽, 高) 并展平为去均值、单位范数的 float32 矩阵"""
+    width, height = size
+    matrix = np.empty((len(watermarks), width * height), dtype=np.float32)
+    for row, watermark in zip(matrix, watermarks):
+        if isinstance(watermark, Image.Image):
+            if watermark.size != (width, height):
+                watermark = watermark.resize((width, height), Image.Resampling.LANCZOS)
+            watermark = np.asarray(watermark)
+        elif watermark.shape[:2] != (height, width):
+            watermark = np.asarray(Image.fromarray(watermark).resize((width, height), Image.Resampling.LANCZOS))
+        row[:] = np.asarray(watermark, dtype=np.float32).ravel()
+
+    matrix -= matrix.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # 常数水印的范数为0，归一化后保持为零向量，相关系数记为0
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
@@ -1,37 +1,101 @@
+import functools
+
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+from instrumentation import stage
+from watermark_cache import WatermarkPlaneCache
+
+DEFAULT_FONT = "arial.ttf"
+DEFAULT_FONT_SIZE = 20
+
+# 渲染好的文本水印缓存，按 (文本, 尺寸, 字体, 字号) 区分，与预处理水印缓存分开计数
+default_text_cache = WatermarkPlaneCache(max_entries=1024, max_bytes=64 * 1024 * 1024)
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(font=DEFAULT_FONT, font_size=DEFAULT_FONT_SIZE):
+    """加载字体并缓存，找不到字体文件时使用PIL默认字体"""
+    try:
+        return ImageFont.truetype(font, font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+
 class WatermarkGenerator:
-    def __init__(self):
-        pass
+    def __init__(self, text_cache=None):
+        # text_cache 为 None 时使用进程内共享的缓存
+        self.text_cache = text_cache if text_cache is not None else default_text_cache
     
-    def generate_text_watermark(self, text, size=(100, 30)):
-        # 创建一个新的白色背景图像
-        watermark = Image.new('L', size, 255)
-        draw = ImageDraw.Draw(watermark)
+    def generate_text_watermark(self, text, size=(100, 30), font=DEFAULT_FONT, font_size=DEFAULT_FONT_SIZE):
+        # 相同文本、尺寸和字体的水印只渲染一次，返回缓存结果的副本
+        size = tuple(size)
+        cached = self.text_cache.get(self._text_key(text), size, 'text', (font, font_size),
+                                     lambda: self._render_text(text, size, font, font_size))
+        return cached.copy()
+    
+    def generate_text_watermarks(self, texts, size=(100, 30), font=DEFAULT_FONT, font_size=DEFAULT_FONT_SIZE):
+        """
+        批量生成文本水印，返回与 texts 顺序对应的数组列表。
+        未缓存的文本共用同一块画布依次渲染，重复的文本只渲染一次。
+        """
+        size = tuple(size)
+        canvas = None
         
-        # 使用默认字体
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            font = ImageFont.load_default()
-            
-        # 获取文本大小
-        text_width = draw.textlength(text, font=font)
-        text_height = 20
+        def render(text):
+            nonlocal canvas
+            if canvas is None:
+                canvas = self._new_canvas(size)
+            return self._draw_text(canvas, text, size, font, font_size)
         
-        # 计算文本位置使其居中
-        x = (size[0] - text_width) // 2
-        y = (size[1] - text_height) // 2
+        results = []
+        for text in texts:
+            cached = self.text_cache.get(self._text_key(text), size, 'text', (font, font_size),
+                                         lambda: render(text))
+            results.append(cached.copy())
+        return results
+    
+    @staticmethod
+    def _text_key(text):
+        # 作为缓存中的水印标识，加前缀以免与图像水印的内容哈希混淆
+        return f"text|{text}"
+    
+    @staticmethod
+    def _new_canvas(size):
+        watermark = Image.new('L', size, 255)
+        return watermark, ImageDraw.Draw(watermark)
+    
+    def _render_text(self, text, size, font, font_size):
+        return self._draw_text(self._new_canvas(size), text, size, font, font_size)
+    
+    @staticmethod
+    def _draw_text(canvas, text, size, font, font_size):
+        watermark, draw = canvas
+        # 清空画布为白色背景
+        watermark.paste(255, (0, 0) + size)
         
-        # 绘制黑色文本
-        draw.text((x, y), text, fill=0, font=font)
+        with stage("generator.text.font"):
+            font = load_font(font, font_size)
+        
+        with stage("generator.text.render"):
+            # 获取文本大小
+            text_width = draw.textlength(text, font=font)
+            text_height = font_size
+            
+            # 计算文本位置使其居中
+            x = (size[0] - text_width) // 2
+            y = (size[1] - text_height) // 2
+            
+            # 绘制黑色文本
+            draw.text((x, y), text, fill=0, font=font)
         
         return np.array(watermark)
     
     def generate_image_watermark(self, image_path, size=(100, 100)):
         # 从文件加载水印图像
-        watermark = Image.open(image_path).convert('L')
-        watermark = watermark.resize(size)
+        with stage("generator.image.load"):
+            watermark = Image.open(image_path).convert('L')
+        with stage("generator.image.resize"):
+            watermark = watermark.resize(size)
         
-        return np.array(watermark) 
\ No newline at end of file
+        return np.array(watermark)
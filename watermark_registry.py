@@ -0,0 +1,203 @@
+import contextlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from PIL import Image
+
+from watermark_detector import CandidateBank, normalize_watermarks
+
+
+class WatermarkRegistry:
+    """
+    持久化的水印登记库。
+
+    目录结构：
+        registry.json  库的基本信息(水印向量的尺寸和数据类型)
+        vectors.f32    预处理后的水印向量，按行连续存放的 float32 原始数据
+        index.jsonl    元数据索引，每行一条 {id, owner, size, algorithm, row}
+        registry.lock  追加时使用的文件锁
+
+    向量文件不带文件头，追加新水印时只需在文件末尾写入一行，不会重写已有数据；
+    加载时通过 np.memmap 零拷贝映射，可直接作为 WatermarkDetector 的候选库使用。
+    多个进程可以同时打开同一个登记库：追加在文件锁内进行，并先重新读取
+    索引和向量文件，因此较早打开的实例也不会覆盖其他实例追加的数据。
+    """
+
+    HEADER_FILE = 'registry.json'
+    VECTORS_FILE = 'vectors.f32'
+    INDEX_FILE = 'index.jsonl'
+    LOCK_FILE = 'registry.lock'
+
+    def __init__(self, path, size=None):
+        """
+        打开 path 处的登记库；不存在时需要给出 size=(宽, 高) 以新建。
+        所有水印都会被统一到该尺寸后再登记。
+        """
+        self.path = path
+        header_path = os.path.join(path, self.HEADER_FILE)
+        if os.path.exists(header_path):
+            with open(header_path, encoding='utf-8') as f:
+                header = json.load(f)
+            if size is not None and tuple(size) != tuple(header['size']):
+                raise ValueError(f"登记库尺寸为 {tuple(header['size'])}，与指定的 {tuple(size)} 不一致")
+        else:
+            if size is None:
+                raise ValueError(f"登记库 {path} 不存在，新建时必须指定水印尺寸")
+            os.makedirs(path, exist_ok=True)
+            header = {'size': list(size), 'dtype': 'float32'}
+            with open(header_path, 'w', encoding='utf-8') as f:
+                json.dump(header, f)
+            open(os.path.join(path, self.VECTORS_FILE), 'ab').close()
+
+        self.size = tuple(header['size'])
+        self.dimension = self.size[0] * self.size[1]
+        self._row_bytes = self.dimension * np.dtype(np.float32).itemsize
+        self._load_index()
+
+    def _load_index(self):
+        self.entries = []
+        self._positions = {}
+        self._bank = None
+        index_path = os.path.join(self.path, self.INDEX_FILE)
+        vectors_size = os.path.getsize(os.path.join(self.path, self.VECTORS_FILE))
+        complete_rows = vectors_size // self._row_bytes
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中断留下的半行，忽略
+                        break
+                    # 只承认向量已完整写入的条目
+                    if entry['row'] >= complete_rows:
+                        break
+                    self._positions[entry['id']] = len(self.entries)
+                    self.entries.append(entry)
+        # 向量已写入但索引未写入的行(追加中断)不属于任何条目，映射时跳过
+        self._total_rows = self.entries[-1]['row'] + 1 if self.entries else 0
+        self._contiguous = all(entry['row'] == i for i, entry in enumerate(self.entries))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # 进程间互斥的写锁，只在追加时持有
+        with open(os.path.join(self.path, self.LOCK_FILE), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, watermark_id):
+        return watermark_id in self._positions
+
+    def get(self, watermark_id):
+        """返回水印的元数据"""
+        return self.entries[self._positions[watermark_id]]
+
+    def add(self, watermark, watermark_id, owner="", algorithm="LSB"):
+        """登记单个水印，返回其行号"""
+        return self.add_many([watermark], [watermark_id], owner=owner, algorithm=algorithm)[0]
+
+    def add_many(self, watermarks, watermark_ids, owner="", algorithm="LSB"):
+        """
+        批量登记水印，向量和索引都以追加方式写入。
+        在文件锁内重新读取索引，其他实例登记过的 id 同样视为重复。
+        """
+        watermarks = list(watermarks)
+        watermark_ids = list(watermark_ids)
+        if len(watermarks) != len(watermark_ids):
+            raise ValueError("水印数量与 id 数量不一致")
+        if len(set(watermark_ids)) != len(watermark_ids):
+            raise ValueError("待登记的水印 id 有重复")
+
+        vectors = normalize_watermarks(watermarks, self.size)
+
+        with self._locked():
+            # 其他实例可能在本实例打开后追加过，以磁盘上的内容为准
+            self._load_index()
+            for watermark_id in watermark_ids:
+                if watermark_id in self._positions:
+                    raise ValueError(f"水印 {watermark_id} 已登记")
+
+            vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+            with open(vectors_path, 'r+b') as f:
+                # 新行从磁盘上完整行的数目开始编号，只截掉最后一个完整行之后中断写入的字节
+                first_row = os.fstat(f.fileno()).st_size // self._row_bytes
+                f.truncate(first_row * self._row_bytes)
+                f.seek(0, os.SEEK_END)
+                f.write(vectors.tobytes())
+
+            index_path = os.path.join(self.path, self.INDEX_FILE)
+            with open(index_path, 'a+b') as f:
+                # 去掉中断写入留下的半行，否则新条目会接在它后面而无法解析
+                f.seek(0)
+                complete = f.read().rfind(b'\n') + 1
+                f.truncate(complete)
+
+            new_entries = []
+            for watermark, watermark_id in zip(watermarks, watermark_ids):
+                if isinstance(watermark, Image.Image):
+                    original_size = watermark.size
+                else:
+                    original_size = (watermark.shape[1], watermark.shape[0])
+                new_entries.append({
+                    'id': watermark_id,
+                    'owner': owner,
+                    'size': list(original_size),
+                    'algorithm': algorithm,
+                    'row': first_row + len(new_entries),
+                })
+
+            with open(index_path, 'a', encoding='utf-8') as f:
+                for entry in new_entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+            self._load_index()
+        return [entry['row'] for entry in new_entries]
+
+    def vectors(self):
+        """
+        以只读内存映射的方式返回 (K, 宽*高) 的向量矩阵，第 i 行对应 entries[i]。
+        只有追加中断留下了无索引的行时才需要复制出对应的行。
+        """
+        if not self.entries:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        mapped = np.memmap(os.path.join(self.path, self.VECTORS_FILE), dtype=np.float32,
+                           mode='r', shape=(self._total_rows, self.dimension))
+        if self._contiguous:
+            return mapped
+        return mapped[[entry['row'] for entry in self.entries]]
+
+    def candidates(self, algorithm=None):
+        """
+        返回可直接传给 WatermarkDetector.score/match 的候选库。
+        指定 algorithm 时只包含该算法的水印(此时会复制出对应的行)。
+        """
+        if algorithm is None:
+            if self._bank is None:
+                self._bank = CandidateBank(self.vectors(), [e['id'] for e in self.entries], self.size)
+            return self._bank
+        positions = [i for i, e in enumerate(self.entries) if e['algorithm'] == algorithm]
+        return CandidateBank(self.vectors()[positions], [self.entries[i]['id'] for i in positions], self.size)
@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, UnidentifiedImageError
+
+from algorithms import get_algorithm
+from dwt_config import save_image
+from image_io import as_host_image
+
+# 每个工作进程内的算法实例，第一次用到时才创建(并导入对应模块)
+_worker_state = {}
+
+
+def encode_image(image):
+    """将PIL图像编码为base64的PNG字符串，DWT嵌入配置写入PNG文本块"""
+    buffer = io.BytesIO()
+    save_image(image, buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def decode_image(spec, host=True):
+    """
+    解析请求中的图像：可以是base64编码的图像数据，
+    也可以是 {"path": "..."} 形式的本地文件路径(服务只转发已检查过的路径)。
+    载体类图像(host=True)保留彩色，水印(host=False)转为灰度。
+    """
+    if isinstance(spec, dict):
+        source = spec['path']
+    else:
+        source = io.BytesIO(base64.b64decode(spec))
+    with Image.open(source) as image:
+        return as_host_image(image) if host else image.convert('L')
+
+
+def _worker(name):
+    instance = _worker_state.get(name)
+    if instance is None:
+        if name == 'detector':
+            from watermark_detector import WatermarkDetector
+            instance = WatermarkDetector()
+        else:
+            instance = get_algorithm(name)
+        _worker_state[name] = instance
+    return instance
+
+
+def _extract(algorithm, params, image, watermark_size):
+    if algorithm == "LSB":
+        return _worker('LSB').extract(image, watermark_size)
+    if algorithm == "DWT_BLIND":
+        return _worker('DWT').extract_blind(image, watermark_size)
+    if algorithm == "DWT":
+        if 'original' not in params:
+            raise ValueError("DWT算法提取水印需要原始载体图像(original)")
+        return _worker('DWT').extract(image, decode_image(params['original']), watermark_size)
+    raise ValueError(f"未知的水印算法: {algorithm}")
+
+
+def _run_job(op, params):
+    algorithm = params.get('algorithm', 'LSB').upper()
+    if op == 'embed':
+        host = decode_image(params['host'])
+        watermark = decode_image(params['watermark'], host=False)
+        if algorithm == "LSB":
+            result = _worker('LSB').embed(host, watermark)
+        elif algorithm == "DWT":
+            result = _worker('DWT').embed(host, watermark)
+        elif algorithm == "DWT_BLIND":
+            result = _worker('DWT').embed_blind(host, watermark)
+        else:
+            raise ValueError(f"未知的水印算法: {algorithm}")
+        return {'image': encode_image(result)}
+
+    if op == 'extract':
+        image = decode_image(params['image'])
+        extracted = _extract(algorithm, params, image, tuple(params['watermark_size']))
+        return {'image': encode_image(extracted)}
+
+    if op == 'detect':
+        image = decode_image(params['image'])
+        watermark = decode_image(params['watermark'], host=False)
+        if algorithm == "DWT_BLIND":
+            is_detected, correlation = _worker('DWT').detect_blind(image, watermark)
+        else:
+            extracted = _extract(algorithm, params, image, watermark.size)
+            is_detected, correlation = _worker('detector').detect(watermark, extracted)
+        return {'detected': bool(is_detected), 'correlation': float(correlation)}
+
+    raise ValueError(f"未知的操作: {op}")
+
+
+# 由请求内容引起的错误(参数缺失或无效、图像无法解码)，HTTP返回400
+_CLIENT_ERRORS = (ValueError, KeyError, TypeError, UnidentifiedImageError, FileNotFoundError)
+
+
+def _run_batch(jobs):
+    """
+    在工作进程中执行一批请求，单个请求失败不影响同批其他请求。
+    返回 [(是否成功, 结果或错误信息, 是否为请求本身的错误), ...]
+    """
+    results = []
+    for op, params in jobs:
+        try:
+            results.append((True, _run_job(op, params), False))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}", isinstance(e, _CLIENT_ERRORS)))
+    return results
+
+
+class ServiceStats:
+    """请求计数、延迟和吞吐量统计"""
+
+    def __init__(self, window=1024):
+        self.started = time.monotonic()
+        self.received = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency, ok):
+        self._latencies.append(latency)
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def snapshot(self, queue_depth=0):
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        uptime = time.monotonic() - self.started
+        return {
+            'uptime': uptime,
+            'received': self.received,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'queue_depth': queue_depth,
+            'throughput': self.completed / uptime if uptime > 0 else 0.0,
+            'latency_p50': percentile(0.50),
+            'latency_p95': percentile(0.95),
+            'latency_p99': percentile(0.99),
+            'latency_max': latencies[-1] if latencies else 0.0,
+        }
+
+
+class WatermarkService:
+    """
+    基于asyncio的水印服务。
+
+    请求进入有界队列，队列满时立即以503拒绝(背压)；调度协程把队列中的
+    请求按 batch_size / batch_window 合并成批，交给进程池执行，
+    从而把CPU密集的计算移出事件循环，并摊薄进程间通信的开销。
+    以 {"path": ...} 传入的图像只允许读取 path_root 目录内的文件，
+    未指定 path_root 时只接受base64编码的图像。
+    """
+
+    OPERATIONS = ('embed', 'extract', 'detect')
+
+    def __init__(self, workers=None, queue_size=256, batch_size=8, batch_window=0.005,
+                 executor=None, path_root=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.path_root = os.path.realpath(path_root) if path_root is not None else None
+        self.stats = ServiceStats()
+        self._executor = executor
+        self._own_executor = executor is None
+        self._queue = None
+        self._dispatcher = None
+        self._inflight = None
+        self._runs = set()
+        self._server = None
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        # 同时在进程池中执行的批次数不超过进程数的两倍
+        self._inflight = asyncio.Semaphore(self.workers * 2)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        """
+        停止服务：不再接受连接和请求，队列中尚未执行的请求以 RuntimeError
+        结束(HTTP返回503)，已提交到进程池的批次执行完毕后才关闭进程池。
+        """
+        server, self._server = self._server, None
+        if server is not None:
+            server.close()
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        if self._queue is not None:
+            pending = []
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            self._fail(pending, "服务已停止")
+        if self._runs:
+            await asyncio.gather(*self._runs, return_exceptions=True)
+        # 等待连接关闭要放在请求都有结果之后，否则处理中的连接会一直挂起
+        if server is not None:
+            await server.wait_closed()
+        if self._executor is not None and self._own_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def submit(self, op, params):
+        """
+        提交一个请求并等待结果，队列已满时抛出 asyncio.QueueFull；
+        请求本身无效时抛出 ValueError，其他执行错误抛出 RuntimeError。
+        """
+        if op not in self.OPERATIONS:
+            raise ValueError(f"未知的操作: {op}")
+        if self._dispatcher is None:
+            raise RuntimeError("服务未运行")
+        params = self._resolve_paths(params)
+        self.stats.received += 1
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((op, params, future, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            raise
+        return await future
+
+    def _resolve_paths(self, params):
+        # 检查以路径传入的图像，只允许 path_root 内的文件(相对路径按 path_root 解析)
+        if not isinstance(params, dict):
+            raise ValueError("请求体必须是JSON对象")
+        resolved = dict(params)
+        for key, value in params.items():
+            if not isinstance(value, dict):
+                continue
+            if self.path_root is None:
+                raise ValueError("服务不允许按路径读取图像，请以base64传入")
+            if not isinstance(value.get('path'), str):
+                raise ValueError(f"无效的图像路径: {key}")
+            path = os.path.realpath(os.path.join(self.path_root, value['path']))
+            if os.path.commonpath([path, self.path_root]) != self.path_root:
+                raise ValueError(f"路径不在允许的目录内: {value['path']}")
+            resolved[key] = {'path': path}
+        return resolved
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = loop.time() + self.batch_window
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._inflight.acquire()
+            except asyncio.CancelledError:
+                # 已从队列取出但还没提交的请求不能丢下不管
+                self._fail(batch, "服务已停止")
+                raise
+            task = asyncio.create_task(self._run(batch))
+            self._runs.add(task)
+            task.add_done_callback(self._runs.discard)
+
+    def _fail(self, batch, message):
+        for _, _, future, _ in batch:
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            self.stats.batches += 1
+            jobs = [(op, params) for op, params, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, _run_batch, jobs)
+            except Exception as e:
+                results = [(False, f"{type(e).__name__}: {e}", False)] * len(batch)
+            now = time.monotonic()
+            for (_, _, future, enqueued), (ok, value, client_error) in zip(batch, results):
+                self.stats.record(now - enqueued, ok)
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(ValueError(value) if client_error else RuntimeError(value))
+        finally:
+            self._inflight.release()
+
+    # ------------------------------------------------------------------
+    # 简单的HTTP/1.1前端，每个连接处理一个请求
+    # ------------------------------------------------------------------
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        await self.start()
+        if unix_path:
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def _handle(self, reader, writer):
+        try:
+            status, body = await self._handle_request(reader)
+        except Exception as e:
+            status, body = 400, {'error': f"{type(e).__name__}: {e}"}
+        payload = json.dumps(body).encode()
+        headers = [f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+                   "Content-Type: application/json",
+                   f"Content-Length: {len(payload)}",
+                   "Connection: close"]
+        if status == 503:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) < 2:
+            return 400, {'error': "无效的请求"}
+        method, path = request_line[0], request_line[1]
+
+        content_length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                content_length = int(value.strip())
+
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats.snapshot(self._queue.qsize())
+
+        op = path.strip('/')
+        if method != 'POST' or op not in self.OPERATIONS:
+            return 404, {'error': f"不支持的请求: {method} {path}"}
+
+        params = json.loads(await reader.readexactly(content_length)) if content_length else {}
+        try:
+            return 200, await self.submit(op, params)
+        except asyncio.QueueFull:
+            return 503, {'error': "服务繁忙，请稍后重试"}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except RuntimeError as e:
+            # 服务停止时未执行的请求返回503，客户端可以稍后重试
+            return (500 if self._dispatcher is not None else 503), {'error': str(e)}
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class WatermarkClient:
+    """用于本地调用和测试的最小客户端"""
+
+    def __init__(self, host="127.0.0.1", port=8765, unix_path=None):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+
+    async def request(self, method, path, body=None):
+        if self.unix_path:
+            reader, writer = await asyncio.open_unix_connection(self.unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n")
+        writer.write(head.encode() + payload)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        content_length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                content_length = int(value.strip())
+        data = json.loads(await reader.readexactly(content_length))
+        writer.close()
+        await writer.wait_closed()
+        return status, data
+
+    async def embed(self, host_image, watermark, algorithm="LSB"):
+        status, data = await self.request('POST', '/embed', {
+            'algorithm': algorithm, 'host': encode_image(host_image), 'watermark': encode_image(watermark)})
+        return status, decode_image(data['image']) if status == 200 else data
+
+    async def extract(self, image, watermark_size, algorithm="LSB", original=None):
+        body = {'algorithm': algorithm, 'image': encode_image(image), 'watermark_size': list(watermark_size)}
+        if original is not None:
+            body['original'] = encode_image(original)
+        status, data = await self.request('POST', '/extract', body)
+        return status, decode_image(data['image']) if status == 200 else data
+
+    async def detect(self, image, watermark, algorithm="LSB", original=None):
+        body = {'algorithm': algorithm, 'image': encode_image(image), 'watermark': encode_image(watermark)}
+        if original is not None:
+            body['original'] = encode_image(original)
+        return await self.request('POST', '/detect', body)
+
+    async def stats(self):
+        return (await self.request('GET', '/stats'))[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数字水印服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", dest="unix_path", default=None, help="监听的Unix套接字路径")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="工作进程数")
+    parser.add_argument("--queue-size", type=int, default=256, help="请求队列的最大长度")
+    parser.add_argument("--batch-size", type=int, default=8, help="每批最多合并的请求数")
+    parser.add_argument("--batch-window", type=float, default=0.005, help="凑批等待时间(秒)")
+    parser.add_argument("--path-root", default=None,
+                        help="允许以 {\"path\": ...} 读取图像的目录，默认只接受base64编码的图像")
+    args = parser.parse_args(argv)
+
+    async def run():
+        service = WatermarkService(workers=args.workers, queue_size=args.queue_size,
+                                   batch_size=args.batch_size, batch_window=args.batch_window,
+                                   path_root=args.path_root)
+        server = await service.serve(args.host, args.port, args.unix_path)
+        where = args.unix_path or f"http://{args.host}:{args.port}"
+        print(f"水印服务已启动: {where}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())